@@ -27,6 +27,7 @@ from .ml import (
     get_estimator_class,
     get_classification_objective,
 )
+from .model import search_caches
 from .config import (
     MIN_SAMPLE_TRAIN,
     MEM_THRES,
@@ -2125,13 +2126,14 @@ class AutoML(BaseEstimator):
                 else "cfo"
             )
         )
-        if log_file_name:
-            with training_log_writer(log_file_name, append_log) as save_helper:
-                self._training_log = save_helper
+        with search_caches():
+            if log_file_name:
+                with training_log_writer(log_file_name, append_log) as save_helper:
+                    self._training_log = save_helper
+                    self._search()
+            else:
+                self._training_log = None
                 self._search()
-        else:
-            self._training_log = None
-            self._search()
         if self._best_estimator:
             logger.info("fit succeeded")
             logger.info(
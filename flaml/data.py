@@ -14,7 +14,7 @@ from typing import Dict, Union, List
 
 # TODO: if your task is not specified in here, define your task as an all-capitalized word
 SEQCLASSIFICATION = "seq-classification"
-CLASSIFICATION = ("binary", "multi", "classification", SEQCLASSIFICATION)
+CLASSIFICATION = frozenset(("binary", "multi", "classification", SEQCLASSIFICATION))
 SEQREGRESSION = "seq-regression"
 REGRESSION = ("regression", SEQREGRESSION)
 TS_FORECAST = "ts_forecast"
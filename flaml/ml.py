@@ -3,6 +3,7 @@
 #  * Licensed under the MIT License. See LICENSE file in the
 #  * project root for license information.
 import time
+from functools import lru_cache
 import numpy as np
 import pandas as pd
 from sklearn.metrics import (
@@ -156,12 +157,10 @@ def metric_loss_score(
             metric_mode = "max"
         else:
             try:
-                import datasets
-
                 datasets_metric_name = huggingface_submetric_to_metric.get(
                     metric_name, metric_name
                 )
-                metric = datasets.load_metric(datasets_metric_name)
+                metric = _load_hf_metric(datasets_metric_name)
                 metric_mode = huggingface_metric_to_mode[datasets_metric_name]
 
                 if "rouge" in metric_name:
@@ -200,6 +199,14 @@ def metric_loss_score(
         return score * multiplier
 
 
+@lru_cache(maxsize=None)
+def _load_hf_metric(metric_name):
+    """Load a huggingface metric once; it is re-used by every evaluation."""
+    import datasets
+
+    return datasets.load_metric(metric_name)
+
+
 def is_in_sklearn_metric_name_set(metric_name):
     return metric_name.startswith("ndcg") or metric_name in sklearn_metric_name_set
 
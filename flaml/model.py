@@ -3,9 +3,15 @@
 #  * Licensed under the MIT License. See LICENSE file in the
 #  * project root for license information.
 from contextlib import contextmanager
-from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, lru_cache
+from collections import OrderedDict
+import copy
+import atexit
+import hashlib
 import signal
 import os
+import secrets
 from typing import Callable, List
 import numpy as np
 import time
@@ -15,7 +21,7 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.dummy import DummyClassifier, DummyRegressor
 from scipy.sparse import issparse
 import logging
-import shutil
+import weakref
 from . import tune
 from .data import (
     group_counts,
@@ -44,6 +50,104 @@ except ImportError:
 
 logger = logging.getLogger("flaml.automl")
 FREE_MEM_RATIO = 0.2
+SMALL_PREDICT_SIZE = 10000
+# below this many rows, DataLoader worker start-up costs more than it hides
+SMALL_LOADER_SIZE = 1000
+# histogram building saturates the memory bandwidth beyond this many threads
+MAX_BOOSTING_THREADS = 16
+_PROC = None
+_VMEM_CACHE = [0.0, None]
+GROUP_COUNTS_CACHE_SIZE = 4
+_GROUP_COUNTS_CACHE = OrderedDict()
+PREPROCESS_CACHE_SIZE = 8
+_PREPROCESS_CACHE = OrderedDict()
+_TRAINING_ARGS_CACHE = {}
+
+
+def _current_process():
+    """The psutil handle of the current process, re-created after a fork."""
+    global _PROC
+    pid = os.getpid()
+    if _PROC is None or _PROC.pid != pid:
+        _PROC = psutil.Process(pid)
+    return _PROC
+
+
+def _cached_vmem(ttl=0.25):
+    """psutil.virtual_memory(), refreshed at most once every ttl seconds."""
+    now = time.monotonic()
+    if _VMEM_CACHE[1] is None or now - _VMEM_CACHE[0] > ttl:
+        _VMEM_CACHE[0], _VMEM_CACHE[1] = now, psutil.virtual_memory()
+    return _VMEM_CACHE[1]
+
+
+def _cached_group_counts(groups):
+    """group_counts(groups), memoized by the content of groups.
+
+    Hashing the ids is linear while group_counts sorts them, and a groups
+    array edited in place or re-created is recounted.
+    """
+    ids = np.ascontiguousarray(groups)
+    if ids.dtype.hasobject:
+        return group_counts(groups)
+    key = (ids.dtype.str, ids.shape, hashlib.blake2b(ids).digest())
+    return _cached_while_alive(
+        _GROUP_COUNTS_CACHE,
+        key,
+        lambda: group_counts(ids),
+        (),
+        GROUP_COUNTS_CACHE_SIZE,
+    )
+
+
+def _cached_while_alive(cache, key, build, alive, maxsize):
+    """build(), memoized in the OrderedDict cache while all the objects in alive
+    (None entries aside) are, so that a reused id() in key never hits a stale
+    value. At most maxsize values are kept, least recently used first out."""
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+        return value
+    value = build()
+    try:
+        for obj in alive:
+            if obj is not None:
+                weakref.finalize(obj, cache.pop, key, None)
+    except TypeError:
+        # not weak-referenceable, e.g., a list
+        return value
+    cache[key] = value
+    while len(cache) > maxsize:
+        cache.popitem(last=False)
+    return value
+
+
+@lru_cache(maxsize=1)
+def _physical_cores():
+    cores = psutil.cpu_count(logical=False) if psutil is not None else None
+    return cores or os.cpu_count() or 1
+
+
+def _boosting_n_jobs(n_jobs):
+    """The thread count for xgboost/catboost; unset or negative means the physical
+    cores, up to MAX_BOOSTING_THREADS."""
+    if n_jobs is None or n_jobs < 0:
+        return min(_physical_cores(), MAX_BOOSTING_THREADS)
+    return n_jobs
+
+
+def _str_columns(X):
+    """Positions of the string columns of a non-numeric numpy array."""
+    return [i for i, value in enumerate(X[0]) if isinstance(value, str)]
+
+
+def _encode_str_columns(X):
+    """Replace the string columns of a non-numeric numpy array by category codes."""
+    X = DataFrame(X)
+    str_columns = X.columns[_str_columns(X.values)]
+    if not str_columns.empty:
+        X[str_columns] = X[str_columns].apply(lambda x: x.astype("category").cat.codes)
+    return X.to_numpy()
 
 
 def TimeoutHandler(sig, frame):
@@ -59,8 +163,12 @@ def limit_resource(memory_limit, time_limit):
     main_thread = False
     if time_limit is not None:
         try:
-            signal.signal(signal.SIGALRM, TimeoutHandler)
-            signal.alarm(int(time_limit) or 1)
+            handler = signal.signal(signal.SIGALRM, TimeoutHandler)
+            start_time = time.monotonic()
+            # setitimer keeps sub-second budgets, unlike alarm() which needs whole seconds
+            outer_delay, _ = signal.setitimer(
+                signal.ITIMER_REAL, max(time_limit, 0.001)
+            )
             main_thread = True
         except ValueError:
             pass
@@ -68,11 +176,40 @@ def limit_resource(memory_limit, time_limit):
         yield
     finally:
         if main_thread:
-            signal.alarm(0)
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(
+                signal.SIGALRM, signal.SIG_DFL if handler is None else handler
+            )
+            if outer_delay > 0:
+                # the caller's timer kept running meanwhile
+                signal.setitimer(
+                    signal.ITIMER_REAL,
+                    max(outer_delay - (time.monotonic() - start_time), 0.001),
+                )
         if memory_limit > 0:
             resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
 
 
+@contextmanager
+def single_thread_for_small_batch(model, X):
+    """Run model with n_jobs=1 when the batch is too small for a thread pool to pay off."""
+    n_jobs = getattr(model, "n_jobs", None)
+    if (
+        n_jobs is None
+        or n_jobs == 1
+        or not hasattr(X, "shape")
+        or (getattr(model, "n_estimators", None) or 1) * X.shape[0]
+        >= SMALL_PREDICT_SIZE
+    ):
+        yield
+        return
+    model.n_jobs = 1
+    try:
+        yield
+    finally:
+        model.n_jobs = n_jobs
+
+
 class BaseEstimator:
     """The abstract class for all learners.
 
@@ -83,6 +220,11 @@ class BaseEstimator:
         for both regression and classification.
     """
 
+    # set by AutoML while it searches on data it owns; only then are the
+    # data derived from the training data shared by the trials, as a direct
+    # fit() caller may edit its data in place between calls
+    _in_search = False
+
     def __init__(self, task="binary", **config):
         """Constructor.
 
@@ -93,21 +235,29 @@ class BaseEstimator:
                 n_jobs is the number of parallel threads.
         """
         self._task = task
+        self._is_classification = task in CLASSIFICATION
+        # config is the private dict built from **config, so config2params
+        # may take it over instead of copying it
+        self._config_owned = True
         self.params = self.config2params(config)
+        self._config_owned = False
         self.estimator_class = self._model = None
         if "_estimator_type" in config:
             self._estimator_type = self.params.pop("_estimator_type")
         else:
             self._estimator_type = (
-                "classifier" if task in CLASSIFICATION else "regressor"
+                "classifier" if self._is_classification else "regressor"
             )
 
     def get_params(self, deep=False):
-        params = self.params.copy()
-        params["task"] = self._task
+        # a fresh dict is required: sklearn's clone() writes into the result
         if hasattr(self, "_estimator_type"):
-            params["_estimator_type"] = self._estimator_type
-        return params
+            return {
+                **self.params,
+                "task": self._task,
+                "_estimator_type": self._estimator_type,
+            }
+        return {**self.params, "task": self._task}
 
     @property
     def classes_(self):
@@ -130,14 +280,32 @@ class BaseEstimator:
     def _preprocess(self, X):
         return X
 
+    def _cached_preprocess(self, X):
+        """self._preprocess(X), memoized while X is alive, as the trials of a
+        search preprocess the same training data again and again.
+        Only results that are new objects are kept. Only used on the training
+        path during a search; predict() always preprocesses afresh."""
+        if not BaseEstimator._in_search:
+            return self._preprocess(X)
+        key = (type(self)._preprocess, id(X), getattr(X, "shape", None))
+        X_pre = _PREPROCESS_CACHE.get(key)
+        if X_pre is not None:
+            _PREPROCESS_CACHE.move_to_end(key)
+            return X_pre
+        X_pre = self._preprocess(X)
+        if X_pre is not X:
+            _cached_while_alive(
+                _PREPROCESS_CACHE, key, lambda: X_pre, (X,), PREPROCESS_CACHE_SIZE
+            )
+        return X_pre
+
     def _fit(self, X_train, y_train, **kwargs):
 
         current_time = time.time()
-        if "groups" in kwargs:
-            kwargs = kwargs.copy()
-            groups = kwargs.pop("groups")
+        groups = kwargs.pop("groups", None)
+        if groups is not None:
             if self._task == "rank":
-                kwargs["group"] = group_counts(groups)
+                kwargs["group"] = _cached_group_counts(groups)
                 # groups_val = kwargs.get('groups_val')
                 # if groups_val is not None:
                 #     kwargs['eval_group'] = [group_counts(groups_val)]
@@ -145,13 +313,11 @@ class BaseEstimator:
                 #         (kwargs['X_val'], kwargs['y_val'])]
                 #     kwargs['verbose'] = False
                 #     del kwargs['groups_val'], kwargs['X_val'], kwargs['y_val']
-        X_train = self._preprocess(X_train)
+        X_train = self._cached_preprocess(X_train)
         model = self.estimator_class(**self.params)
-        if logger.level == logging.DEBUG:
-            logger.debug(f"flaml.model - {model} fit started")
+        logger.debug("flaml.model - %s fit started", model)
         model.fit(X_train, y_train, **kwargs)
-        if logger.level == logging.DEBUG:
-            logger.debug(f"flaml.model - {model} fit finished")
+        logger.debug("flaml.model - %s fit finished", model)
         train_time = time.time() - current_time
         self._model = model
         return train_time
@@ -173,11 +339,11 @@ class BaseEstimator:
             and (budget is not None or psutil is not None)
         ):
             start_time = time.time()
-            mem = psutil.virtual_memory() if psutil is not None else None
+            mem = _cached_vmem() if psutil is not None else None
             try:
                 with limit_resource(
                     mem.available * (1 - FREE_MEM_RATIO)
-                    + psutil.Process(os.getpid()).memory_info().rss
+                    + _current_process().memory_info().rss
                     if mem is not None
                     else -1,
                     budget,
@@ -185,7 +351,7 @@ class BaseEstimator:
                     train_time = self._fit(X_train, y_train, **kwargs)
             except (MemoryError, TimeoutError) as e:
                 logger.warning(f"{e.__class__} {e}")
-                if self._task in CLASSIFICATION:
+                if self._is_classification:
                     model = DummyClassifier()
                 else:
                     model = DummyRegressor()
@@ -209,12 +375,13 @@ class BaseEstimator:
         """
         if self._model is not None:
             X_test = self._preprocess(X_test)
-            return self._model.predict(X_test)
+            with single_thread_for_small_batch(self._model, X_test):
+                return self._model.predict(X_test)
         else:
             logger.warning(
                 "Estimator is not fit yet. Please run fit() before predict()."
             )
-            return np.ones(X_test.shape[0])
+            return np.broadcast_to(np.ones(1), (X_test.shape[0],))
 
     def predict_proba(self, X_test):
         """Predict the probability of each class from features.
@@ -229,10 +396,11 @@ class BaseEstimator:
             Each element at (i,j) is the probability for instance i to be in
                 class j.
         """
-        assert self._task in CLASSIFICATION, "predict_proba() only for classification."
+        assert self._is_classification, "predict_proba() only for classification."
 
         X_test = self._preprocess(X_test)
-        return self._model.predict_proba(X_test)
+        with single_thread_for_small_batch(self._model, X_test):
+            return self._model.predict_proba(X_test)
 
     def cleanup(self):
         del self._model
@@ -287,32 +455,218 @@ class BaseEstimator:
         Returns:
             A dict that will be passed to self.estimator_class's constructor.
         """
-        params = config.copy()
-        return params
+        return config if self._config_owned else config.copy()
+
+
+def _fast_rmtree(path):
+    """Remove a directory tree written by us, relying on scandir's cached file types.
+
+    Unlike shutil.rmtree, no extra stat calls are made per entry.
+    """
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                _fast_rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+    os.rmdir(path)
+
+
+def _load_training_args(task):
+    """The transformers TrainingArguments class for task, imported once per process."""
+    is_nlg = task in NLG_TASKS
+    training_args_class = _TRAINING_ARGS_CACHE.get(is_nlg)
+    if training_args_class is None:
+        if is_nlg:
+            from transformers import Seq2SeqTrainingArguments as training_args_class
+        else:
+            from transformers import TrainingArguments as training_args_class
+        _TRAINING_ARGS_CACHE[is_nlg] = training_args_class
+    return training_args_class
+
+
+@lru_cache(maxsize=1)
+def _load_teacher(checkpoint_path, task, num_labels):
+    """The teacher is inference only, so one frozen instance is shared by all trials."""
+    from .nlp.utils import load_model
+
+    teacher = load_model(
+        checkpoint_path=checkpoint_path, task=task, num_labels=num_labels
+    )
+    teacher.eval()
+    teacher.requires_grad_(False)
+    return teacher
+
+
+@lru_cache(maxsize=1)
+def _load_pretrained(checkpoint_path, task, num_labels, per_model_config):
+    from .nlp.utils import load_model
+
+    return load_model(
+        checkpoint_path=checkpoint_path,
+        task=task,
+        num_labels=num_labels,
+        per_model_config=dict(per_model_config),
+    )
+
+
+def _init_pretrained(checkpoint_path, task, num_labels, per_model_config=None):
+    """A fresh copy of the pretrained model.
+
+    The Trainer calls model_init both in its constructor and in train(), so the
+    checkpoint is read from disk once and deep-copied afterwards.
+    """
+    base = _load_pretrained(
+        checkpoint_path,
+        task,
+        num_labels,
+        tuple(sorted(per_model_config.items())) if per_model_config else (),
+    )
+    return copy.deepcopy(base)
+
+
+def _configure_cuda_allocator():
+    """Let the CUDA caching allocator grow segments instead of splitting them.
+
+    Trials build and drop models of different sizes, which otherwise fragments
+    the cache. This only has an effect before CUDA is initialized, and a
+    PYTORCH_CUDA_ALLOC_CONF set by the user is left alone.
+    """
+    if "PYTORCH_CUDA_ALLOC_CONF" in os.environ:
+        return
+    import torch
+
+    # expandable_segments is rejected as an unknown option before torch 2.1
+    version = tuple(int(v) for v in torch.__version__.split(".")[:2] if v.isdigit())
+    if version >= (2, 1) and not torch.cuda.is_initialized():
+        os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "expandable_segments:True"
+
+
+@lru_cache(maxsize=1)
+def _early_stopping_callback_class():
+    """EarlyStoppingCallbackForAuto, defined once transformers is available."""
+    from transformers import EarlyStoppingCallback
+
+    class EarlyStoppingCallbackForAuto(EarlyStoppingCallback):
+        """Stop training when the time budget or max_steps is about to be exceeded."""
+
+        def __init__(self, budget, max_steps):
+            super().__init__()
+            self.budget = budget
+            self.max_steps = max_steps
+
+        def on_train_begin(self, args, state, control, **callback_kwargs):
+            self.train_begin_time = time.monotonic()
+
+        def on_step_begin(self, args, state, control, **callback_kwargs):
+            self.step_begin_time = time.monotonic()
+
+        def on_step_end(self, args, state, control, **callback_kwargs):
+            now = time.monotonic()
+            step_time = now - self.step_begin_time
+            # a moving average, so that a stall in the first step does not
+            # skew the estimate for the rest of the training
+            if state.global_step == 1:
+                self.time_per_iter = step_time
+            else:
+                self.time_per_iter = 0.9 * self.time_per_iter + 0.1 * step_time
+            if (
+                self.budget
+                and now + self.time_per_iter > self.train_begin_time + self.budget
+                or state.global_step >= self.max_steps
+            ):
+                control.should_training_stop = True
+                control.should_save = True
+                control.should_evaluate = True
+            return control
+
+        def on_epoch_end(self, args, state, control, **callback_kwargs):
+            if control.should_training_stop or state.epoch + 1 >= args.num_train_epochs:
+                control.should_save = True
+                control.should_evaluate = True
+
+    return EarlyStoppingCallbackForAuto
+
 
 class TransformersEstimator(BaseEstimator):
     """
     The base class for fine-tuning & distill model
     """
-    ITER_HP = "global_max_steps" # NOTE: not sure if this should be included here
+
+    ITER_HP = "global_max_steps"  # NOTE: not sure if this should be included here
+    # pending deletions are finished at interpreter exit, as the pool's
+    # worker threads are joined then
+    _CLEANUP_POOL = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+    PREP_CACHE_SIZE = 4
+    EVAL_BATCH_SIZE = 64
+    DECODE_CHUNK_SIZE = 256
+    _prep_cache = {}
+    _dataset_cache = {}
+    # each cached trainer holds a model, possibly on the GPU
+    PREDICT_CACHE_SIZE = 2
+    _predict_trainer_cache = OrderedDict()
+    _is_text = None
+    _data_parallel_warned = False
 
     def __init__(self, task="seq-classification", **config):
         super().__init__(task, **config)
-        import uuid
-
-        self.trial_id = str(uuid.uuid1().hex)[:8]
-        if task in NLG_TASKS:
-            from transformers import Seq2SeqTrainingArguments as TrainingArguments
-        else:
-            from transformers import TrainingArguments
-        self._TrainingArguments = TrainingArguments
+        # os.urandom based, so unaffected by the seeding done in fit()
+        self.trial_id = secrets.token_hex(4)
+        self._TrainingArguments = _load_training_args(task)
+        _configure_cuda_allocator()
 
     @staticmethod
-    def _join(X_train, y_train):
-        y_train = DataFrame(y_train, columns=["label"], index=X_train.index)
-        train_df = X_train.join(y_train)
-        return train_df
-    
+    def _to_columns(X_train, y_train):
+        """The columns of X_train plus a "label" column unless y_train is None, as
+        Dataset.from_dict input.
+
+        Going through a dict of columns, rather than joining into a DataFrame for
+        Dataset.from_pandas, avoids the intermediate frame.
+        """
+        columns = {}
+        for col in X_train.columns:
+            values = X_train[col].tolist()
+            if (
+                values
+                and isinstance(values[0], list)
+                and len({len(v) for v in values}) == 1
+            ):
+                # token ids padded to the same length go in as one 2-d array,
+                # which Arrow converts without visiting every element in Python
+                values = np.asarray(values, dtype=np.int32)
+            columns[col] = values
+        if y_train is None:
+            return columns
+        if isinstance(y_train, DataFrame):
+            y_train = y_train["label"]
+        label = np.asarray(y_train)
+        columns["label"] = (
+            label if label.ndim == 1 and label.dtype != object else list(y_train)
+        )
+        return columns
+
+    @classmethod
+    def _to_dataset(cls, X, y):
+        """The Arrow dataset of X joined with y, reused while X and y are the same objects.
+
+        During a search, the tokenized frames returned by _cached_preprocess are
+        cached, so across trials the very same objects arrive here again.
+        """
+        from datasets import Dataset
+
+        if not BaseEstimator._in_search:
+            return Dataset.from_dict(cls._to_columns(X, y))
+        cache = TransformersEstimator._dataset_cache
+        key = (id(X), id(y))
+        cached = cache.get(key)
+        if cached is not None and cached[0] is X and cached[1] is y:
+            return cached[2]
+        dataset = Dataset.from_dict(cls._to_columns(X, y))
+        cache[key] = (X, y, dataset)
+        if len(cache) > cls.PREP_CACHE_SIZE:
+            cache.pop(next(iter(cache)))
+        return dataset
+
     # NOTE: args modified, add data_size back
     @classmethod
     def search_space(cls, data_size, task, **params):
@@ -358,129 +712,207 @@ class TransformersEstimator(BaseEstimator):
             setattr(custom_hpo_args, key, val)
         self.custom_hpo_args = custom_hpo_args
 
+    def config2params(self, config: dict) -> dict:
+        params = config if self._config_owned else config.copy()
+        params.setdefault(self.ITER_HP, sys.maxsize)
+        return params
+
     def _preprocess(self, X, y=None, **kwargs):
         from .nlp.utils import tokenize_text
 
-        is_str = str(X.dtypes[0]) in ("string", "str")
+        # an estimator is fed either raw text or already tokenized frames,
+        # so the dtype only needs to be inspected once
+        if self._is_text is None:
+            self._is_text = str(X.dtypes.iloc[0]) in ("string", "str")
 
-        if is_str:
+        if self._is_text:
             return tokenize_text(
                 X=X, Y=y, task=self._task, custom_hpo_args=self.custom_hpo_args
             )
         else:
             return X, None
 
-    def _compute_metrics_by_dataset_name(self, eval_pred):
-        from .ml import metric_loss_score
-
-        predictions, labels = eval_pred
-        predictions = (
-            np.squeeze(predictions)
-            if self._task == SEQREGRESSION
-            else np.argmax(predictions, axis=1)
+    def _cached_preprocess(self, X, y=None, **kwargs):
+        """self._preprocess(X, y), reused during an AutoML search while X and y
+        are the very same objects, as every trial tokenizes the same training
+        and validation frames. Only used on the training path."""
+        if not BaseEstimator._in_search:
+            return self._preprocess(X, y, **kwargs)
+        cache = TransformersEstimator._prep_cache
+        key = (
+            id(X),
+            id(y),
+            X.shape,
+            self._task,
+            self.custom_hpo_args.model_path,
+            self.custom_hpo_args.max_seq_length,
         )
+        cached = cache.get(key)
+        if cached is not None and cached[0] is X and cached[1] is y:
+            return cached[2]
+        tokenized = self._preprocess(X, y, **kwargs)
+        if self._is_text:
+            cache[key] = (X, y, tokenized)
+            if len(cache) > self.PREP_CACHE_SIZE:
+                cache.pop(next(iter(cache)))
+        return tokenized
+
+    def _reduce_predictions(self, predictions):
+        """Flatten regression outputs or take the argmax of classification logits.
+
+        The argmax result is written into a buffer kept on the estimator, so it
+        is only valid until the next call.
+        """
+        if self._task == SEQREGRESSION or predictions.ndim == 1:
+            # already reduced on device by _reduce_logits
+            return predictions.reshape(-1)
+        buf = getattr(self, "_argmax_buf", None)
+        if buf is None or buf.shape[0] != predictions.shape[0]:
+            buf = self._argmax_buf = np.empty(predictions.shape[0], dtype=np.intp)
+        return np.argmax(predictions, axis=1, out=buf)
+
+    def _eval_precision_args(self):
+        """Run prediction entirely in bf16, or fp16 on GPUs without bf16 support."""
+        import torch
+
+        if not self.custom_hpo_args.fp16 or not torch.cuda.is_available():
+            return {}
+        fields = self._TrainingArguments.__dataclass_fields__
+        if "bf16_full_eval" in fields and torch.cuda.is_bf16_supported():
+            return {"bf16_full_eval": True}
+        if "fp16_full_eval" in fields:
+            return {"fp16_full_eval": True}
+        return {}
 
-        return {
-            "val_loss": metric_loss_score(
-                metric_name=self._metric_name, y_predict=predictions, y_true=labels
-                )
-            }
-    
-    def _delete_one_ckpt(self, ckpt_location):
-            if self.use_ray is False:
-                try:
-                    shutil.rmtree(ckpt_location)
-                except FileNotFoundError:
-                    logger.warning("checkpoint {} not found".format(ckpt_location))
-
-    def cleanup(self):
-        super().cleanup()
-        if hasattr(self, "_ckpt_remains"):
-            for each_ckpt in self._ckpt_remains:
-                self._delete_one_ckpt(each_ckpt)
+    def _compile_args(self):
+        """torch.compile the model through TrainingArguments if asked to.
 
-    def _select_checkpoint(self, trainer):
-        from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
+        Skipped under ray, where every trial runs in a fresh worker and would
+        pay the compilation again.
+        """
+        if (
+            getattr(self.custom_hpo_args, "use_compile", False)
+            and not self.use_ray
+            and "torch_compile" in self._TrainingArguments.__dataclass_fields__
+        ):
+            return {"torch_compile": True}
+        return {}
 
-        if trainer.ckpt_to_metric:
-            best_ckpt, _ = min(
-                trainer.ckpt_to_metric.items(), key=lambda x: x[1]["eval_loss"]
+    def _add_grad_accumulation(self, training_args_config):
+        """Accumulate gradients up to custom_hpo_args.target_effective_batch_size, so
+        that small per-device batches still make full size optimizer steps."""
+        target = getattr(self.custom_hpo_args, "target_effective_batch_size", None)
+        if target and "gradient_accumulation_steps" not in training_args_config:
+            batch_size = training_args_config.get(
+                "per_device_train_batch_size",
+                self._TrainingArguments.per_device_train_batch_size,
             )
-            best_ckpt_global_step = trainer.ckpt_to_global_step[best_ckpt]
-            for each_ckpt in list(trainer.ckpt_to_metric):
-                if each_ckpt != best_ckpt:
-                    del trainer.ckpt_to_metric[each_ckpt]
-                    del trainer.ckpt_to_global_step[each_ckpt]
-                    self._delete_one_ckpt(each_ckpt)
-        else:
-            best_ckpt_global_step = trainer.state.global_step
-            best_ckpt = os.path.join(
-                trainer.args.output_dir,
-                f"{PREFIX_CHECKPOINT_DIR}-{best_ckpt_global_step}",
+            training_args_config["gradient_accumulation_steps"] = max(
+                1, target // batch_size
             )
-        self.params[self.ITER_HP] = best_ckpt_global_step
-        print(trainer.state.global_step)
-        print(trainer.ckpt_to_global_step)
-        return best_ckpt
-
-
-class DistillingEstimator(TransformersEstimator):
-
-    """
-    The class for fine-tuning distill BERT model
+        return training_args_config
+
+    def _enable_grad_checkpointing(self, model):
+        """Trade recomputation for activation memory, by default only for models
+        with more than 100M parameters."""
+        enable = getattr(self.custom_hpo_args, "gradient_checkpointing", None)
+        if enable is None:
+            enable = model.num_parameters() > 1e8
+        if enable and getattr(model, "supports_gradient_checkpointing", False):
+            model.gradient_checkpointing_enable()
+        return model
+
+    def _dataloader_args(self):
+        """The DataLoader arguments for TrainingArguments, limited to those the
+        installed transformers knows about."""
+        num_workers = getattr(self.custom_hpo_args, "dataloader_num_workers", None)
+        if num_workers is None:
+            num_workers = min(8, (os.cpu_count() or 2) // 2)
+        dataloader_args = {
+            "dataloader_num_workers": num_workers,
+            "dataloader_pin_memory": True,
+        }
+        if num_workers > 0:
+            dataloader_args["dataloader_persistent_workers"] = True
+            dataloader_args["dataloader_prefetch_factor"] = 4
+        fields = self._TrainingArguments.__dataclass_fields__
+        return {key: val for key, val in dataloader_args.items() if key in fields}
+
+    def _reduce_logits(self, logits, labels):
+        """Reduce the logits on device, so that only the predicted ids (one value
+        per example, or per token for NLG tasks) are gathered to the host."""
+        if isinstance(logits, tuple):
+            logits = logits[0]
+        if self._task == SEQREGRESSION:
+            return logits.squeeze(-1)
+        return logits.argmax(dim=-1)
+
+    def _metrics_kwargs(self):
+        """The compute_metrics related arguments for TrainerForAuto."""
+        import inspect
+        from transformers import Trainer
+
+        metrics_kwargs = {"compute_metrics": self._compute_metrics_by_dataset_name}
+        trainer_params = inspect.signature(Trainer.__init__).parameters
+        if "preprocess_logits_for_metrics" in trainer_params:
+            metrics_kwargs["preprocess_logits_for_metrics"] = self._reduce_logits
+        return metrics_kwargs
 
-    TODO: after completion, 
-    modify ml.py by: adding import at L34, set estimator_class at L116
-    """
-    ITER_HP = "global_max_steps"
+    @classmethod
+    def _warn_data_parallel(cls):
+        """Point to torchrun once, when several GPUs would be driven by DataParallel.
 
-    def __init__(self, task="qa", **config):       
-        super().__init__(task, **config)
+        Under torchrun, LOCAL_RANK is set and TrainingArguments picks it up to
+        take the DistributedDataParallel path.
+        """
+        if TransformersEstimator._data_parallel_warned or "LOCAL_RANK" in os.environ:
+            return
+        import torch
 
-    def _init_hpo_args(self, automl_fit_kwargs: dict = None):
-        from .nlp.utils import DISTILHPOArgs,load_model
-        # TODO: setup student and teacher seperatly,
-        #  refer to: https://github.com/huggingface/transformers/blob/master/examples/research_projects/distillation/run_squad_w_distillation.py
-        custom_hpo_args = DISTILHPOArgs()
-        for key, val in automl_fit_kwargs["custom_hpo_args"].items():
-            assert (
-                    key in custom_hpo_args.__dict__
-            ), "The specified key {} is not in the argument list of flaml.nlp.utils::DISTILHPOArgs".format(
-                key
+        n_gpus = torch.cuda.device_count()
+        if n_gpus > 1:
+            TransformersEstimator._data_parallel_warned = True
+            logger.warning(
+                "%d GPUs are visible but the trainer runs in a single process, which"
+                " falls back to DataParallel; launching with"
+                " `torchrun --nproc_per_node=%d` uses the faster"
+                " DistributedDataParallel instead.",
+                n_gpus,
+                n_gpus,
             )
-            setattr(custom_hpo_args, key, val)
-        self.custom_hpo_args = custom_hpo_args
 
-    # NOTE: moved out from DistillingEstimator.__init__(), args modified 
-    @classmethod
-    def search_space(cls, data_size, task, **params):
-        search_space_dict = super().search_space(data_size, task)
-        if task == SEQREGRESSION:
-            search_space_dict["alpha_mse"] =  {"domain": tune.uniform(lower=0.5, upper=1.0), "init_value": 0.5}
-        else:
-            search_space_dict["alpha_ce"] = {"domain":tune.uniform(lower=0.5, upper=1.0),"init_value": 0.5}
+    def _precision_args(self):
+        """The mixed precision arguments for TrainingArguments.
 
-        search_space_dict["alpha_task"] = {"domain": tune.uniform(lower=0.5, upper=1.0), "init_value": 0.5}
-        return search_space_dict
+        bf16 with TF32 matmuls is preferred over fp16 on GPUs supporting it.
+        """
+        if not self.custom_hpo_args.fp16:
+            return {"fp16": False}
+        import torch
 
-    def fit(self,X_train: DataFrame, y_train: Series, budget=None, **kwargs):
-        from transformers import EarlyStoppingCallback
-        from datasets import Dataset
+        fields = self._TrainingArguments.__dataclass_fields__
+        if (
+            "bf16" in fields
+            and torch.cuda.is_available()
+            and torch.cuda.is_bf16_supported()
+        ):
+            # tf32 was added to TrainingArguments after bf16
+            return {"bf16": True, "tf32": True} if "tf32" in fields else {"bf16": True}
+        return {"fp16": True}
+
+    def fit(self, X_train: DataFrame, y_train: Series, budget=None, **kwargs):
         from transformers.trainer_utils import set_seed
-        from transformers import AutoTokenizer
 
         import transformers
         from .nlp.utils import (
             get_num_labels,
             separate_config,
-            load_model,
             compute_checkpoint_freq,
             get_trial_fold_name,
             date_str,
+            load_tokenizer,
         )
-        # import logging
 
-        # logger = logging.getLogger(__name__)
         # TODO: if self._task == QUESTIONANSWERING, uncomment the code below (add indentation before
         #  from .nlp.huggingface.trainer import TrainerForAuto)
 
@@ -489,62 +921,26 @@ class DistillingEstimator(TransformersEstimator):
         # else:
         from .nlp.huggingface.trainer import TrainerForAuto
 
-        this_params = self.params
-
-        class EarlyStoppingCallbackForAuto(EarlyStoppingCallback):
-            def on_train_begin(self, args, state, control, **callback_kwargs):
-                self.train_begin_time = time.time()
-
-            def on_step_begin(self, args, state, control, **callback_kwargs):
-                self.step_begin_time = time.time()
-
-            def on_step_end(self, args, state, control, **callback_kwargs):
-                if state.global_step == 1:
-                    self.time_per_iter = time.time() - self.step_begin_time
-                if (
-                    budget
-                    and (
-                        time.time() + self.time_per_iter
-                        > self.train_begin_time + budget
-                    )
-                    or state.global_step >= this_params[FineTuningEstimator.ITER_HP]
-                ):
-                    control.should_training_stop = True
-                    control.should_save = True
-                    control.should_evaluate = True
-                return control
-
-            def on_epoch_end(self, args, state, control, **callback_kwargs):
-                if (
-                    control.should_training_stop
-                    or state.epoch + 1 >= args.num_train_epochs
-                ):
-                    control.should_save = True
-                    control.should_evaluate = True
-
-
         set_seed(self.params.get("seed", self._TrainingArguments.seed))
 
         self._init_hpo_args(kwargs)
-        self._metric_name = kwargs["metric"]
+        self._metric = kwargs["metric"]
+        self._warn_data_parallel()
         if hasattr(self, "use_ray") is False:
             self.use_ray = kwargs["use_ray"]
 
-            X_val = kwargs.get("X_val")
+        X_val = kwargs.get("X_val")
         y_val = kwargs.get("y_val")
 
         if self._task not in NLG_TASKS:
-            X_train, _ = self._preprocess(X=X_train, **kwargs)
-            #X_train = self._preprocess(X=X_train, task=self._task, **kwargs)
+            self._X_train, _ = self._cached_preprocess(X=X_train, **kwargs)
+            self._y_train = y_train
         else:
-            X_train, y_train = self._preprocess(
+            self._X_train, self._y_train = self._cached_preprocess(
                 X=X_train, y=y_train, **kwargs
             )
-            # X_train = self._preprocess(
-            #     X=X_train, task=self._task, **kwargs
-            # )
 
-        train_dataset = Dataset.from_pandas(self._join(X_train, y_train))
+        train_dataset = self._to_dataset(self._X_train, self._y_train)
 
         # TODO: set a breakpoint here, observe the resulting train_dataset,
         #  compare it with the output of the tokenized results in your transformer example
@@ -554,33 +950,27 @@ class DistillingEstimator(TransformersEstimator):
 
         if X_val is not None:
             if self._task not in NLG_TASKS:
-                X_val, _ = self._preprocess(X=X_val, task=self._task, **kwargs)
-                # X_val = self._preprocess(X=X_val, task=self._task, **kwargs)
+                self._X_val, _ = self._cached_preprocess(X=X_val, **kwargs)
+                self._y_val = y_val
             else:
-                X_val, y_val = self._preprocess(
-                    X=X_val, y=y_val, task=self._task, **kwargs
+                self._X_val, self._y_val = self._cached_preprocess(
+                    X=X_val, y=y_val, **kwargs
                 )
-                # X_val = self._preprocess(
-                #     X=X_val, task=self._task, **kwargs
-                # )
-                
-            eval_dataset = Dataset.from_pandas(self._join(X_val, y_val))
+            eval_dataset = self._to_dataset(self._X_val, self._y_val)
         else:
             eval_dataset = None
 
-        tokenizer = AutoTokenizer.from_pretrained(
-            self.custom_hpo_args.model_path , use_fast=True
-        )
+        tokenizer = load_tokenizer(self.custom_hpo_args.model_path)
         self._tokenizer = tokenizer
 
-        num_labels = get_num_labels(self._task, y_train)
+        num_labels = get_num_labels(self._task, self._y_train)
 
         training_args_config, per_model_config = separate_config(
             self.params, self._task
         )
-
+        training_args_config = self._add_grad_accumulation(training_args_config)
         ckpt_freq = compute_checkpoint_freq(
-            train_data_size=len(train_dataset),
+            train_data_size=len(self._X_train),
             custom_hpo_args=self.custom_hpo_args,
             num_train_epochs=training_args_config.get(
                 "num_train_epochs", self._TrainingArguments.num_train_epochs
@@ -588,7 +978,8 @@ class DistillingEstimator(TransformersEstimator):
             batch_size=training_args_config.get(
                 "per_device_train_batch_size",
                 self._TrainingArguments.per_device_train_batch_size,
-            ),
+            )
+            * training_args_config.get("gradient_accumulation_steps", 1),
         )
 
         local_dir = os.path.join(
@@ -619,45 +1010,47 @@ class DistillingEstimator(TransformersEstimator):
             )
         else:
             from transformers import IntervalStrategy
+
             training_args = self._TrainingArguments(
                 report_to=[],
                 output_dir=trial_dir,
                 do_train=True,
                 do_eval=True,
-                per_device_eval_batch_size=1,
+                per_device_eval_batch_size=self.EVAL_BATCH_SIZE,
                 eval_steps=ckpt_freq,
                 evaluation_strategy=IntervalStrategy.STEPS,
                 save_steps=ckpt_freq,
                 save_total_limit=0,
-                fp16=self.custom_hpo_args.fp16,
+                **self._precision_args(),
+                **self._compile_args(),
+                **self._dataloader_args(),
                 load_best_model_at_end=True,
                 **training_args_config,
             )
 
         def _model_init():
-            return load_model(
-                checkpoint_path=self.custom_hpo_args.student_name_or_path,
+            model = _init_pretrained(
+                checkpoint_path=self._trained_model_path(),
                 task=self._task,
                 num_labels=num_labels,
                 per_model_config=per_model_config,
             )
+            return self._enable_grad_checkpointing(model)
+
+        self.teacher = self._load_teacher_model(num_labels)
 
-        self.teacher = load_model(
-                checkpoint_path=self.custom_hpo_args.teacher_name_or_path,
-                task=self._task,
-                num_labels=num_labels,
-            )
-        
         self._model = TrainerForAuto(
-                args=training_args,
-                teacher=self.teacher,
-                model_init=_model_init,
-                train_dataset=train_dataset,
-                eval_dataset=eval_dataset,
-                tokenizer=tokenizer,
-                compute_metrics=self._compute_metrics_by_dataset_name,
-                callbacks=[EarlyStoppingCallbackForAuto],
-            )
+            args=training_args,
+            teacher=self.teacher,
+            model_init=_model_init,
+            train_dataset=train_dataset,
+            eval_dataset=eval_dataset,
+            tokenizer=tokenizer,
+            **self._metrics_kwargs(),
+            callbacks=[
+                _early_stopping_callback_class()(budget, self.params[self.ITER_HP])
+            ],
+        )
 
         setattr(self._model, "_use_ray", self.use_ray)
         if self._task in NLG_TASKS:
@@ -674,437 +1067,314 @@ class DistillingEstimator(TransformersEstimator):
 
         self._ckpt_remains = list(self._model.ckpt_to_metric.keys())
 
-    def _delete_one_ckpt(self, ckpt_location):
-        if self.use_ray is False:
-            try:
-                shutil.rmtree(ckpt_location)
-            except FileNotFoundError:
-                logger.warning("checkpoint {} not found".format(ckpt_location))
+    def _trained_model_path(self):
+        """The pretrained checkpoint the trained model starts from."""
+        return self.custom_hpo_args.model_path
 
-    def cleanup(self):
-        super().cleanup()
-        if hasattr(self, "_ckpt_remains"):
-            for each_ckpt in self._ckpt_remains:
-                self._delete_one_ckpt(each_ckpt)
+    def _load_teacher_model(self, num_labels):
+        """The teacher to distill from, None for plain fine-tuning."""
+        return None
 
-    def _select_checkpoint(self, trainer):
-        from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
+    def _decode_nlg(self, predictions, labels):
+        """Decode generated ids and label ids into post-processed text.
 
-        if trainer.ckpt_to_metric:
-            best_ckpt, _ = min(
-                trainer.ckpt_to_metric.items(), key=lambda x: x[1]["eval_loss"]
-            )
-            best_ckpt_global_step = trainer.ckpt_to_global_step[best_ckpt]
-            for each_ckpt in list(trainer.ckpt_to_metric):
-                if each_ckpt != best_ckpt:
-                    del trainer.ckpt_to_metric[each_ckpt]
-                    del trainer.ckpt_to_global_step[each_ckpt]
-                    self._delete_one_ckpt(each_ckpt)
-        else:
-            best_ckpt_global_step = trainer.state.global_step
-            best_ckpt = os.path.join(
-                trainer.args.output_dir,
-                f"{PREFIX_CHECKPOINT_DIR}-{best_ckpt_global_step}",
+        The arrays are decoded DECODE_CHUNK_SIZE rows at a time, so only the
+        argmax of one chunk of logits is resident at once.
+        """
+        from .nlp.utils import postprocess_text
+
+        if isinstance(predictions, tuple):
+            predictions = predictions[0]
+        decoded_preds, decoded_labels = [], []
+        for start in range(0, len(labels), self.DECODE_CHUNK_SIZE):
+            chunk = slice(start, start + self.DECODE_CHUNK_SIZE)
+            pred_ids = predictions[chunk]
+            if pred_ids.ndim == 3:
+                pred_ids = np.argmax(pred_ids, axis=2)
+            # the label array is owned by the eval loop, fill the ignored
+            # positions in place instead of allocating a full-size copy
+            label_ids = labels[chunk]
+            np.putmask(label_ids, label_ids == -100, self._tokenizer.pad_token_id)
+            preds, refs = postprocess_text(
+                self._tokenizer.batch_decode(pred_ids, skip_special_tokens=True),
+                self._tokenizer.batch_decode(label_ids, skip_special_tokens=True),
             )
-        self.params[self.ITER_HP] = best_ckpt_global_step
-        print(trainer.state.global_step)
-        print(trainer.ckpt_to_global_step)
-        return best_ckpt
+            decoded_preds.extend(preds)
+            decoded_labels.extend(refs)
+        return decoded_preds, decoded_labels
 
     def _compute_metrics_by_dataset_name(self, eval_pred):
         from .ml import metric_loss_score
-        from .nlp.utils import postprocess_text
 
         predictions, labels = eval_pred
-
-        if self._task in NLG_TASKS:
-            if isinstance(predictions, tuple):
-                predictions = np.argmax(predictions[0], axis=2)
-            decoded_preds = self._tokenizer.batch_decode(
-                predictions, skip_special_tokens=True
-            )
-            labels = np.where(labels != -100, labels, self._tokenizer.pad_token_id)
-            decoded_labels = self._tokenizer.batch_decode(
-                labels, skip_special_tokens=True
-            )
-            predictions, labels = postprocess_text(decoded_preds, decoded_labels)
-        else:
-            predictions = (
-                np.squeeze(predictions)
-                if self._task == SEQREGRESSION
-                else np.argmax(predictions, axis=1)
-            )
+        predictions = self._reduce_predictions(predictions)
 
         return {
             "val_loss": metric_loss_score(
-                metric_name=self._metric_name, y_predict=predictions, y_true=labels
+                metric_name=self._metric, y_predict=predictions, y_true=labels
             )
         }
 
-    def predict_proba(self, X_test):
-        assert (
-            self._task in CLASSIFICATION
-        ), "predict_proba() only for classification tasks."
+    @staticmethod
+    def _rmtree_ckpt(ckpt_location):
+        try:
+            _fast_rmtree(ckpt_location)
+        except FileNotFoundError:
+            logger.warning("checkpoint {} not found".format(ckpt_location))
+
+    def _delete_ckpts(self, ckpt_locations):
+        """Delete checkpoints in the background, one job per checkpoint."""
+        if self.use_ray is not False or not ckpt_locations:
+            return
+        # move the checkpoints out of the way with O(1) renames, then let
+        # the background worker delete them while the next trial runs
+        trash_dir = os.path.join(self.custom_hpo_args.output_dir, ".trash")
+        os.makedirs(trash_dir, exist_ok=True)
+        to_delete = []
+        for ckpt_location in ckpt_locations:
+            try:
+                trashed = os.path.join(trash_dir, secrets.token_hex(8))
+                os.rename(ckpt_location, trashed)
+                to_delete.append(trashed)
+            except FileNotFoundError:
+                logger.warning("checkpoint {} not found".format(ckpt_location))
+            except OSError:
+                # e.g., the output dir is on another file system
+                to_delete.append(ckpt_location)
+        if not hasattr(self, "_cleanup_futures"):
+            self._cleanup_futures = set()
+        for ckpt_location in to_delete:
+            future = TransformersEstimator._CLEANUP_POOL.submit(
+                self._rmtree_ckpt, ckpt_location
+            )
+            self._cleanup_futures.add(future)
+            future.add_done_callback(self._cleanup_futures.discard)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("deleting {} checkpoints".format(len(to_delete)))
+
+    def _test_dataset(self, X_test):
+        """The Dataset to predict X_test with, and the order of its rows.
 
+        Except for NLG tasks, the padding added by the tokenizer is stripped and
+        the rows are sorted by length, so that the collator of the prediction
+        trainer pads each batch only to its own longest sequence.
+        """
         from datasets import Dataset
-        from .nlp.huggingface.trainer import TrainerForAuto
-        from transformers import TrainingArguments
-        from .nlp.utils import load_model
 
-        X_test, _ = self._preprocess(X_test, task=self._task, **self._kwargs)
-        test_dataset = Dataset.from_pandas(X_test)
+        X_test, _ = self._preprocess(X=X_test, **self._kwargs)
+        columns = self._to_columns(X_test, None)
+        if (
+            self._task in NLG_TASKS
+            or "attention_mask" not in columns
+            or self._tokenizer.padding_side != "right"
+        ):
+            return Dataset.from_dict(columns), None
+        lengths = np.asarray(columns["attention_mask"]).sum(axis=1)
+        order = np.argsort(lengths, kind="stable")
+        columns = {
+            col: [values[i][: lengths[i]] for i in order]
+            for col, values in columns.items()
+        }
+        return Dataset.from_dict(columns), order
 
-        best_model = load_model(
-            checkpoint_path=self._checkpoint_path,
-            task=self._task,
-            num_labels=self._num_labels,
-            per_model_config=self._per_model_config,
-        )
-        training_args = TrainingArguments(
-            per_device_eval_batch_size=1,
-            output_dir=self.custom_hpo_args.output_dir,
+    @staticmethod
+    def _restore_order(predictions, order):
+        if order is None:
+            return predictions
+        restored = np.empty_like(predictions)
+        restored[order] = predictions
+        return restored
+
+    def predict_proba(self, X_test):
+        assert self._is_classification, "predict_proba() only for classification tasks."
+
+        test_dataset, order = self._test_dataset(X_test)
+        self._model = self._get_predict_trainer()
+        if hasattr(self._model, "preprocess_logits_for_metrics"):
+            self._model.preprocess_logits_for_metrics = None
+        predictions = self._predict_batched(test_dataset)
+        # half precision logits from the model are returned as float32
+        return self._restore_order(
+            predictions.predictions.astype(np.float32, copy=False), order
         )
-        self._model = TrainerForAuto(model=best_model, args=training_args)
-        predictions = self._model.predict(test_dataset)
-        return predictions.predictions
 
     def predict(self, X_test):
-        from datasets import Dataset
-        from .nlp.utils import load_model
-        from .nlp.huggingface.trainer import TrainerForAuto
-
-        X_test, _ = self._preprocess(X=X_test, task=self._task, **self._kwargs)
-        test_dataset = Dataset.from_pandas(X_test)
-
-        best_model = load_model(
-            checkpoint_path=self._checkpoint_path,
-            task=self._task,
-            num_labels=self._num_labels,
-            per_model_config=self._per_model_config,
-        )
-        training_args = self._TrainingArguments(
-            per_device_eval_batch_size=1,
-            output_dir=self.custom_hpo_args.output_dir,
-            **self._training_args_config,
-        )
-        self._model = TrainerForAuto(model=best_model, args=training_args)
+        test_dataset, order = self._test_dataset(X_test)
+        self._model = self._get_predict_trainer()
+        if self._task != SEQREGRESSION and hasattr(
+            self._model, "preprocess_logits_for_metrics"
+        ):
+            # take the argmax on device, only the ids are copied to the host
+            self._model.preprocess_logits_for_metrics = self._reduce_logits
+        training_args = self._model.args
         if self._task not in NLG_TASKS:
-            predictions = self._model.predict(test_dataset)
+            predictions = self._predict_batched(test_dataset)
         else:
-            predictions = self._model.predict(
+            predictions = self._predict_batched(
                 test_dataset,
                 max_length=training_args.generation_max_length,
                 num_beams=training_args.generation_num_beams,
             )
 
         if self._task == SEQCLASSIFICATION:
-            return np.argmax(predictions.predictions, axis=1)
+            predictions = predictions.predictions
+            if predictions.ndim > 1:
+                predictions = np.argmax(predictions, axis=1)
+            return self._restore_order(predictions, order)
         elif self._task == SEQREGRESSION:
-            return predictions.predictions
+            return self._restore_order(
+                predictions.predictions.astype(np.float32, copy=False), order
+            )
         # TODO: elif self._task == your task, return the corresponding prediction
         #  e.g., if your task == QUESTIONANSWERING, you need to return the answer instead
         #  of the index
         elif self._task == SUMMARIZATION:
-            if isinstance(predictions.predictions, tuple):
-                predictions = np.argmax(predictions.predictions[0], axis=2)
+            predictions = predictions.predictions
+            if isinstance(predictions, tuple):
+                predictions = np.argmax(predictions[0], axis=2)
             decoded_preds = self._tokenizer.batch_decode(
                 predictions, skip_special_tokens=True
             )
             return decoded_preds
 
-    def config2params(self, config: dict) -> dict:
-        params = config.copy()
-        params[FineTuningEstimator.ITER_HP] = params.get(
-            FineTuningEstimator.ITER_HP, sys.maxsize
-        )
-        return params
-
-class FineTuningEstimator(TransformersEstimator):
-    """The class for fine-tuning language models, using huggingface transformers API."""
-
-    ITER_HP = "global_max_steps"
-
-    def __init__(self, task="seq-classification", **config):
-        super().__init__(task, **config)
-        import uuid
-
-        self.trial_id = str(uuid.uuid1().hex)[:8]
-        if task in NLG_TASKS:
-            from transformers import Seq2SeqTrainingArguments as TrainingArguments
-        else:
-            from transformers import TrainingArguments
-        self._TrainingArguments = TrainingArguments
-
-         # @classmethod
-    @classmethod
-    def search_space(cls, data_size, task, **params):
-        search_space_dict = super().search_space(data_size, task)
-        # search_space_dict = super().search_space()
-        if task in NLG_TASKS:
-            search_space_dict["generation_num_beams"] = {
-                "domain": tune.randint(2, 5),
-                "init_value": 3,
-            }
-            search_space_dict["generation_max_length"] = {
-                "domain": tune.choice([16, 32, 64, 128]),
-                "init_value": 64,
-            }
-        #
-        return search_space_dict
-
-    def _init_hpo_args(self, automl_fit_kwargs: dict = None):
-        from .nlp.utils import HPOArgs
-
-        custom_hpo_args = HPOArgs()
-        for key, val in automl_fit_kwargs["custom_hpo_args"].items():
-            assert (
-                key in custom_hpo_args.__dict__
-            ), "The specified key {} is not in the argument list of flaml.nlp.utils::HPOArgs".format(
-                key
-            )
-            setattr(custom_hpo_args, key, val)
-        self.custom_hpo_args = custom_hpo_args
-
-    def _preprocess(self, X, y=None, **kwargs):
-        from .nlp.utils import tokenize_text
+    def _get_predict_trainer(self):
+        """The trainer for the best checkpoint, loaded on the first prediction.
 
-        # is_str = False
-        # for each_type in ["string", "str"]:
-        #     try:
-        #         is_str = is_str or (X.dtypes[0] == each_type)
-        #     except TypeError:
-        #         pass
-        is_str = str(X.dtypes[0]) in ("string", "str")
-
-        if is_str:
-            return tokenize_text(
-                X=X, Y=y, task=self._task, custom_hpo_args=self.custom_hpo_args
-            )
-        else:
-            return X, None
-
-    def fit(self, X_train: DataFrame, y_train: Series, budget=None, **kwargs):
-        from transformers import EarlyStoppingCallback
-        from transformers.trainer_utils import set_seed
-        from transformers import AutoTokenizer
-
-        import transformers
-        from datasets import Dataset
-        from .nlp.utils import (
-            get_num_labels,
-            separate_config,
-            load_model,
-            compute_checkpoint_freq,
-            get_trial_fold_name,
-            date_str,
-        )
-
-        # TODO: if self._task == QUESTIONANSWERING, uncomment the code below (add indentation before
-        #  from .nlp.huggingface.trainer import TrainerForAuto)
-
-        # if self._task in NLG_TASKS:
-        #     from .nlp.huggingface.trainer import Seq2SeqTrainerForAuto as TrainerForAuto
-        # else:
+        The trainers are kept in a small class-level LRU cache, so that later
+        predictions, also from copies of the estimator, reuse the loaded model.
+        """
+        from .nlp.utils import load_model
         from .nlp.huggingface.trainer import TrainerForAuto
 
-        this_params = self.params
-
-        class EarlyStoppingCallbackForAuto(EarlyStoppingCallback):
-            def on_train_begin(self, args, state, control, **callback_kwargs):
-                self.train_begin_time = time.time()
-
-            def on_step_begin(self, args, state, control, **callback_kwargs):
-                self.step_begin_time = time.time()
-
-            def on_step_end(self, args, state, control, **callback_kwargs):
-                if state.global_step == 1:
-                    self.time_per_iter = time.time() - self.step_begin_time
-                if (
-                    budget
-                    and (
-                        time.time() + self.time_per_iter
-                        > self.train_begin_time + budget
-                    )
-                    or state.global_step >= this_params[FineTuningEstimator.ITER_HP]
-                ):
-                    control.should_training_stop = True
-                    control.should_save = True
-                    control.should_evaluate = True
-                return control
-
-            def on_epoch_end(self, args, state, control, **callback_kwargs):
-                if (
-                    control.should_training_stop
-                    or state.epoch + 1 >= args.num_train_epochs
-                ):
-                    control.should_save = True
-                    control.should_evaluate = True
-
-        set_seed(self.params.get("seed", self._TrainingArguments.seed))
-
-        self._init_hpo_args(kwargs)
-        self._metric = kwargs["metric"]
-        if hasattr(self, "use_ray") is False:
-            self.use_ray = kwargs["use_ray"]
-
-        X_val = kwargs.get("X_val")
-        y_val = kwargs.get("y_val")
-
-        if self._task not in NLG_TASKS:
-            self._X_train, _ = self._preprocess(X=X_train, **kwargs)
-            self._y_train = y_train
-        else:
-            self._X_train, self._y_train = self._preprocess(
-                X=X_train, y=y_train, **kwargs
-            )
-
-        train_dataset = Dataset.from_pandas(
-            TransformersEstimator._join(self._X_train, self._y_train)
-        )
-
-        # TODO: set a breakpoint here, observe the resulting train_dataset,
-        #  compare it with the output of the tokenized results in your transformer example
-        #  for example, if your task is MULTIPLECHOICE, you need to compare train_dataset with
-        #  the output of https://github.com/huggingface/transformers/blob/master/examples/pytorch/multiple-choice/run_swag.py#L329
-        #  make sure they are the same
-
-        if X_val is not None:
-            if self._task not in NLG_TASKS:
-                self._X_val, _ = self._preprocess(X=X_val, **kwargs)
-                self._y_val = y_val
-            else:
-                self._X_val, self._y_val = self._preprocess(X=X_val, y=y_val, **kwargs)
-            eval_dataset = Dataset.from_pandas(
-                TransformersEstimator._join(self._X_val, self._y_val)
-            )
-        else:
-            eval_dataset = None
-
-        tokenizer = AutoTokenizer.from_pretrained(
-            self.custom_hpo_args.model_path, use_fast=True
-        )
-        self._tokenizer = tokenizer
-
-        num_labels = get_num_labels(self._task, self._y_train)
-
-        training_args_config, per_model_config = separate_config(
-            self.params, self._task
+        cache = TransformersEstimator._predict_trainer_cache
+        key = self._predict_trainer_key()
+        trainer = cache.get(key)
+        if trainer is not None:
+            cache.move_to_end(key)
+            return trainer
+        best_model = load_model(
+            checkpoint_path=self._checkpoint_path,
+            task=self._task,
+            num_labels=self._num_labels,
+            per_model_config=self._per_model_config,
         )
-        ckpt_freq = compute_checkpoint_freq(
-            train_data_size=len(self._X_train),
-            custom_hpo_args=self.custom_hpo_args,
-            num_train_epochs=training_args_config.get(
-                "num_train_epochs", self._TrainingArguments.num_train_epochs
-            ),
-            batch_size=training_args_config.get(
-                "per_device_train_batch_size",
-                self._TrainingArguments.per_device_train_batch_size,
+        training_args = self._TrainingArguments(
+            per_device_eval_batch_size=getattr(
+                self.custom_hpo_args, "predict_batch_size", self.EVAL_BATCH_SIZE
             ),
+            output_dir=self.custom_hpo_args.output_dir,
+            **self._eval_precision_args(),
+            **self._compile_args(),
+            **self._dataloader_args(),
+            **self._training_args_config,
         )
-
-        local_dir = os.path.join(
-            self.custom_hpo_args.output_dir, "train_{}".format(date_str())
-        )
-
-        if not self.use_ray:
-            # if self.params = {}, don't include configuration in trial fold name
-            trial_dir = get_trial_fold_name(local_dir, self.params, self.trial_id)
-        else:
-            import ray
-
-            trial_dir = ray.tune.get_trial_dir()
-
-        if transformers.__version__.startswith("3"):
-            training_args = self._TrainingArguments(
-                report_to=[],
-                output_dir=trial_dir,
-                do_train=True,
-                do_eval=True,
-                eval_steps=ckpt_freq,
-                evaluate_during_training=True,
-                save_steps=ckpt_freq,
-                save_total_limit=0,
-                fp16=self.custom_hpo_args.fp16,
-                load_best_model_at_end=True,
-                **training_args_config,
-            )
+        if self._task in NLG_TASKS:
+            trainer = TrainerForAuto(model=best_model, args=training_args)
         else:
-            from transformers import IntervalStrategy
+            from transformers import DataCollatorWithPadding
 
-            training_args = self._TrainingArguments(
-                report_to=[],
-                output_dir=trial_dir,
-                do_train=True,
-                do_eval=True,
-                per_device_eval_batch_size=1,
-                eval_steps=ckpt_freq,
-                evaluation_strategy=IntervalStrategy.STEPS,
-                save_steps=ckpt_freq,
-                save_total_limit=0,
-                fp16=self.custom_hpo_args.fp16,
-                load_best_model_at_end=True,
-                **training_args_config,
-            )
-
-        def _model_init():
-            return load_model(
-                checkpoint_path=self.custom_hpo_args.model_path,
-                task=self._task,
-                num_labels=num_labels,
-                per_model_config=per_model_config,
+            # multiples of 8 keep the padded shapes friendly to tensor cores
+            trainer = TrainerForAuto(
+                model=best_model,
+                args=training_args,
+                data_collator=DataCollatorWithPadding(
+                    self._tokenizer, pad_to_multiple_of=8
+                ),
             )
+        cache[key] = trainer
+        if len(cache) > self.PREDICT_CACHE_SIZE:
+            cache.popitem(last=False)
+        return trainer
+
+    def _predict_trainer_key(self):
+        return (
+            self._checkpoint_path,
+            self._task,
+            self._num_labels,
+            repr(self._per_model_config),
+        )
 
-        self._model = TrainerForAuto(
-            args=training_args,
-            model_init=_model_init,
-            train_dataset=train_dataset,
-            eval_dataset=eval_dataset,
-            tokenizer=tokenizer,
-            compute_metrics=self._compute_metrics_by_dataset_name,
-            callbacks=[EarlyStoppingCallbackForAuto],
-        )
-
-        setattr(self._model, "_use_ray", self.use_ray)
-        if self._task in NLG_TASKS:
-            setattr(self._model, "_is_seq2seq", True)
-        self._model.train()
-
-        self.params[self.ITER_HP] = self._model.state.global_step
-        self._checkpoint_path = self._select_checkpoint(self._model)
+    def _predict_batched(self, test_dataset, **predict_kwargs):
+        """self._model.predict(), halving the batch size on CUDA out of memory errors.
 
-        self._kwargs = kwargs
-        self._num_labels = num_labels
-        self._per_model_config = per_model_config
-        self._training_args_config = training_args_config
+        The reduced batch size is kept for the following predictions. Small
+        test sets are loaded in the main process.
+        """
+        from dataclasses import replace
 
-        self._ckpt_remains = list(self._model.ckpt_to_metric.keys())
+        args = self._model.args
+        if len(test_dataset) < SMALL_LOADER_SIZE and args.dataloader_num_workers > 0:
+            self._model.args = self._serial_loader_args(args)
+        try:
+            while True:
+                try:
+                    return self._model.predict(test_dataset, **predict_kwargs)
+                except RuntimeError as e:
+                    batch_size = self._model.args.per_device_eval_batch_size
+                    if "out of memory" not in str(e) or batch_size <= 1:
+                        raise
+                    import torch
+
+                    torch.cuda.empty_cache()
+                    self._model.args = replace(
+                        self._model.args, per_device_eval_batch_size=batch_size // 2
+                    )
+                    logger.warning(
+                        "out of memory in predict(), retrying with batch size %d",
+                        batch_size // 2,
+                    )
+        finally:
+            batch_size = self._model.args.per_device_eval_batch_size
+            if self._model.args is not args:
+                self._model.args = (
+                    args
+                    if batch_size == args.per_device_eval_batch_size
+                    else replace(args, per_device_eval_batch_size=batch_size)
+                )
 
-    def _delete_one_ckpt(self, ckpt_location):
-        if self.use_ray is False:
-            try:
-                shutil.rmtree(ckpt_location)
-            except FileNotFoundError:
-                logger.warning("checkpoint {} not found".format(ckpt_location))
+    @staticmethod
+    def _serial_loader_args(args):
+        """args with the DataLoader running in the main process."""
+        from dataclasses import replace
+
+        fields = args.__dataclass_fields__
+        changes = {"dataloader_num_workers": 0}
+        if "dataloader_persistent_workers" in fields:
+            changes["dataloader_persistent_workers"] = False
+        if "dataloader_prefetch_factor" in fields:
+            changes["dataloader_prefetch_factor"] = None
+        return replace(args, **changes)
 
     def cleanup(self):
         super().cleanup()
+        if hasattr(self, "_checkpoint_path"):
+            TransformersEstimator._predict_trainer_cache.pop(
+                self._predict_trainer_key(), None
+            )
         if hasattr(self, "_ckpt_remains"):
-            for each_ckpt in self._ckpt_remains:
-                self._delete_one_ckpt(each_ckpt)
+            self._delete_ckpts(self._ckpt_remains)
+        self.teacher = None
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_initialized():
+            # hand the cached blocks of the discarded trainer back once per
+            # trial, so that the next trial's model can use them
+            import gc
+
+            gc.collect()
+            torch.cuda.empty_cache()
 
     def _select_checkpoint(self, trainer):
         from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
 
         if trainer.ckpt_to_metric:
-            best_ckpt, _ = min(
-                trainer.ckpt_to_metric.items(), key=lambda x: x[1]["eval_loss"]
-            )
+            # the best checkpoint is tracked by TrainerForAuto.evaluate
+            best_ckpt = trainer.best_ckpt
             best_ckpt_global_step = trainer.ckpt_to_global_step[best_ckpt]
-            for each_ckpt in list(trainer.ckpt_to_metric):
-                if each_ckpt != best_ckpt:
-                    del trainer.ckpt_to_metric[each_ckpt]
-                    del trainer.ckpt_to_global_step[each_ckpt]
-                    self._delete_one_ckpt(each_ckpt)
+            self._delete_ckpts(
+                [ckpt for ckpt in trainer.ckpt_to_metric if ckpt != best_ckpt]
+            )
+            trainer.ckpt_to_metric = {best_ckpt: trainer.ckpt_to_metric[best_ckpt]}
+            trainer.ckpt_to_global_step = {best_ckpt: best_ckpt_global_step}
         else:
             best_ckpt_global_step = trainer.state.global_step
             best_ckpt = os.path.join(
@@ -1112,33 +1382,128 @@ class FineTuningEstimator(TransformersEstimator):
                 f"{PREFIX_CHECKPOINT_DIR}-{best_ckpt_global_step}",
             )
         self.params[self.ITER_HP] = best_ckpt_global_step
-        print(trainer.state.global_step)
-        print(trainer.ckpt_to_global_step)
         return best_ckpt
 
+
+class DistillingEstimator(TransformersEstimator):
+    """
+    The class for fine-tuning distill BERT model
+
+    TODO: after completion,
+    modify ml.py by: adding import at L34, set estimator_class at L116
+    """
+
+    ITER_HP = "global_max_steps"
+
+    def __init__(self, task="qa", **config):
+        super().__init__(task, **config)
+
+    def _init_hpo_args(self, automl_fit_kwargs: dict = None):
+        from .nlp.utils import DISTILHPOArgs, load_model
+
+        # TODO: setup student and teacher seperatly,
+        #  refer to: https://github.com/huggingface/transformers/blob/master/examples/research_projects/distillation/run_squad_w_distillation.py
+        custom_hpo_args = DISTILHPOArgs()
+        for key, val in automl_fit_kwargs["custom_hpo_args"].items():
+            assert (
+                key in custom_hpo_args.__dict__
+            ), "The specified key {} is not in the argument list of flaml.nlp.utils::DISTILHPOArgs".format(
+                key
+            )
+            setattr(custom_hpo_args, key, val)
+        self.custom_hpo_args = custom_hpo_args
+
+    def _trained_model_path(self):
+        return self.custom_hpo_args.student_name_or_path
+
+    def _load_teacher_model(self, num_labels):
+        teacher_path = self.custom_hpo_args.teacher_name_or_path
+        if teacher_path and teacher_path != self.custom_hpo_args.student_name_or_path:
+            return _load_teacher(teacher_path, self._task, num_labels)
+        # distilling a model into itself adds nothing; train without teacher
+        return None
+
+    # NOTE: moved out from DistillingEstimator.__init__(), args modified
+    @classmethod
+    def search_space(cls, data_size, task, **params):
+        search_space_dict = super().search_space(data_size, task)
+        if task == SEQREGRESSION:
+            search_space_dict["alpha_mse"] = {
+                "domain": tune.uniform(lower=0.5, upper=1.0),
+                "init_value": 0.5,
+            }
+        else:
+            search_space_dict["alpha_ce"] = {
+                "domain": tune.uniform(lower=0.5, upper=1.0),
+                "init_value": 0.5,
+            }
+
+        search_space_dict["alpha_task"] = {
+            "domain": tune.uniform(lower=0.5, upper=1.0),
+            "init_value": 0.5,
+        }
+        return search_space_dict
+
+    def _compute_metrics_by_dataset_name(self, eval_pred):
+        from .ml import metric_loss_score
+
+        predictions, labels = eval_pred
+
+        if self._task in NLG_TASKS:
+            predictions, labels = self._decode_nlg(predictions, labels)
+        else:
+            predictions = self._reduce_predictions(predictions)
+
+        return {
+            "val_loss": metric_loss_score(
+                metric_name=self._metric, y_predict=predictions, y_true=labels
+            )
+        }
+
+
+class FineTuningEstimator(TransformersEstimator):
+    """The class for fine-tuning language models, using huggingface transformers API."""
+
+    ITER_HP = "global_max_steps"
+
+    @classmethod
+    def search_space(cls, data_size, task, **params):
+        search_space_dict = super().search_space(data_size, task)
+        # search_space_dict = super().search_space()
+        if task in NLG_TASKS:
+            search_space_dict["generation_num_beams"] = {
+                "domain": tune.randint(2, 5),
+                "init_value": 3,
+            }
+            search_space_dict["generation_max_length"] = {
+                "domain": tune.choice([16, 32, 64, 128]),
+                "init_value": 64,
+            }
+        #
+        return search_space_dict
+
+    def _init_hpo_args(self, automl_fit_kwargs: dict = None):
+        from .nlp.utils import HPOArgs
+
+        custom_hpo_args = HPOArgs()
+        for key, val in automl_fit_kwargs["custom_hpo_args"].items():
+            assert (
+                key in custom_hpo_args.__dict__
+            ), "The specified key {} is not in the argument list of flaml.nlp.utils::HPOArgs".format(
+                key
+            )
+            setattr(custom_hpo_args, key, val)
+        self.custom_hpo_args = custom_hpo_args
+
     def _compute_metrics_by_dataset_name(self, eval_pred):
         if isinstance(self._metric, str):
             from .ml import metric_loss_score
-            from .nlp.utils import postprocess_text
 
             predictions, labels = eval_pred
             if self._task in NLG_TASKS:
-                if isinstance(predictions, tuple):
-                    predictions = np.argmax(predictions[0], axis=2)
-                decoded_preds = self._tokenizer.batch_decode(
-                    predictions, skip_special_tokens=True
-                )
-                labels = np.where(labels != -100, labels, self._tokenizer.pad_token_id)
-                decoded_labels = self._tokenizer.batch_decode(
-                    labels, skip_special_tokens=True
-                )
-                predictions, labels = postprocess_text(decoded_preds, decoded_labels)
+                predictions, labels = self._decode_nlg(predictions, labels)
             else:
-                predictions = (
-                    np.squeeze(predictions)
-                    if self._task == SEQREGRESSION
-                    else np.argmax(predictions, axis=1)
-                )
+                predictions = self._reduce_predictions(predictions)
             return {
                 "val_loss": metric_loss_score(
                     metric_name=self._metric, y_predict=predictions, y_true=labels
@@ -1155,84 +1520,6 @@ class FineTuningEstimator(TransformersEstimator):
             )
             return metric_dict
 
-    def predict_proba(self, X_test):
-        assert (
-            self._task in CLASSIFICATION
-        ), "predict_proba() only for classification tasks."
-
-        from datasets import Dataset
-        from .nlp.huggingface.trainer import TrainerForAuto
-        from transformers import TrainingArguments
-        from .nlp.utils import load_model
-
-        X_test, _ = self._preprocess(X_test, **self._kwargs)
-        test_dataset = Dataset.from_pandas(X_test)
-
-        best_model = load_model(
-            checkpoint_path=self._checkpoint_path,
-            task=self._task,
-            num_labels=self._num_labels,
-            per_model_config=self._per_model_config,
-        )
-        training_args = TrainingArguments(
-            per_device_eval_batch_size=1,
-            output_dir=self.custom_hpo_args.output_dir,
-        )
-        self._model = TrainerForAuto(model=best_model, args=training_args)
-        predictions = self._model.predict(test_dataset)
-        return predictions.predictions
-
-    def predict(self, X_test):
-        from datasets import Dataset
-        from .nlp.utils import load_model
-        from .nlp.huggingface.trainer import TrainerForAuto
-
-        X_test, _ = self._preprocess(X=X_test, **self._kwargs)
-        test_dataset = Dataset.from_pandas(X_test)
-
-        best_model = load_model(
-            checkpoint_path=self._checkpoint_path,
-            task=self._task,
-            num_labels=self._num_labels,
-            per_model_config=self._per_model_config,
-        )
-        training_args = self._TrainingArguments(
-            per_device_eval_batch_size=1,
-            output_dir=self.custom_hpo_args.output_dir,
-            **self._training_args_config,
-        )
-        self._model = TrainerForAuto(model=best_model, args=training_args)
-        if self._task not in NLG_TASKS:
-            predictions = self._model.predict(test_dataset)
-        else:
-            predictions = self._model.predict(
-                test_dataset,
-                max_length=training_args.generation_max_length,
-                num_beams=training_args.generation_num_beams,
-            )
-
-        if self._task == SEQCLASSIFICATION:
-            return np.argmax(predictions.predictions, axis=1)
-        elif self._task == SEQREGRESSION:
-            return predictions.predictions
-        # TODO: elif self._task == your task, return the corresponding prediction
-        #  e.g., if your task == QUESTIONANSWERING, you need to return the answer instead
-        #  of the index
-        elif self._task == SUMMARIZATION:
-            if isinstance(predictions.predictions, tuple):
-                predictions = np.argmax(predictions.predictions[0], axis=2)
-            decoded_preds = self._tokenizer.batch_decode(
-                predictions, skip_special_tokens=True
-            )
-            return decoded_preds
-
-    def config2params(self, config: dict) -> dict:
-        params = config.copy()
-        params[FineTuningEstimator.ITER_HP] = params.get(
-            FineTuningEstimator.ITER_HP, sys.maxsize
-        )
-        return params
-
 
 class SKLearnEstimator(BaseEstimator):
     """The base class for tuning scikit-learn estimators."""
@@ -1244,15 +1531,14 @@ class SKLearnEstimator(BaseEstimator):
         if isinstance(X, DataFrame):
             cat_columns = X.select_dtypes(include=["category"]).columns
             if not cat_columns.empty:
-                X = X.copy()
-                X[cat_columns] = X[cat_columns].apply(lambda x: x.cat.codes)
+                # a shallow copy shares the untouched columns with the caller's
+                # frame; only the re-encoded columns are materialized
+                X = X.copy(deep=False)
+                for col in cat_columns:
+                    X[col] = X[col].cat.codes
         elif isinstance(X, np.ndarray) and X.dtype.kind not in "buif":
             # numpy array is not of numeric dtype
-            X = DataFrame(X)
-            for col in X.columns:
-                if isinstance(X[col][0], str):
-                    X[col] = X[col].astype("category").cat.codes
-            X = X.to_numpy()
+            X = _encode_str_columns(X)
         return X
 
 
@@ -1261,6 +1547,10 @@ class LGBMEstimator(BaseEstimator):
 
     ITER_HP = "n_estimators"
     HAS_CALLBACK = True
+    # (t1, time_per_iter, mem_per_iter) measured without callbacks, shared by
+    # the trials of a search on the same data with a similar tree size
+    CALIBRATION_CACHE_SIZE = 64
+    _calibration_cache = OrderedDict()
 
     @classmethod
     def search_space(cls, data_size, **params):
@@ -1307,7 +1597,7 @@ class LGBMEstimator(BaseEstimator):
         }
 
     def config2params(self, config: dict) -> dict:
-        params = config.copy()
+        params = config if self._config_owned else config.copy()
         if "log_max_bin" in params:
             params["max_bin"] = (1 << params.pop("log_max_bin")) - 1
         return params
@@ -1346,21 +1636,38 @@ class LGBMEstimator(BaseEstimator):
         self.HAS_CALLBACK = self.HAS_CALLBACK and self._callbacks(0, 0) is not None
 
     def _preprocess(self, X):
-        if (
-            not isinstance(X, DataFrame)
-            and issparse(X)
-            and np.issubdtype(X.dtype, np.integer)
-        ):
-            X = X.astype(float)
-        elif isinstance(X, np.ndarray) and X.dtype.kind not in "buif":
-            # numpy array is not of numeric dtype
-            X = DataFrame(X)
-            for col in X.columns:
-                if isinstance(X[col][0], str):
-                    X[col] = X[col].astype("category").cat.codes
-            X = X.to_numpy()
+        if isinstance(X, DataFrame):
+            return X
+        if isinstance(X, np.ndarray):
+            if X.dtype.kind not in "buif":
+                # numpy array is not of numeric dtype
+                X = _encode_str_columns(X)
+        elif issparse(X) and np.issubdtype(X.dtype, np.integer):
+            # lightgbm only takes float sparse data; float32 is what xgboost
+            # uses internally and halves the copy compared to float64
+            X = X.astype(np.float32)
         return X
 
+    def _calibration_key(self, X_train):
+        params = self.params
+        # sklearn forests keep their leaf count in max_leaf_nodes
+        leaves = params.get(
+            "num_leaves", params.get("max_leaves", params.get("max_leaf_nodes"))
+        )
+        n_iter = params.get(self.ITER_HP)
+        return (
+            type(self),
+            id(X_train),
+            X_train.shape,
+            int(np.log2(leaves)) if leaves and leaves > 0 else 0,
+            int(np.log2(n_iter)) if n_iter and n_iter > 0 else 0,
+            params.get("max_bin"),
+            params.get("max_features"),
+            params.get("criterion"),
+            params.get("n_jobs"),
+            getattr(self, "_hist_split", None),
+        )
+
     def fit(self, X_train, y_train, budget=None, **kwargs):
         start_time = time.time()
         deadline = start_time + budget if budget else np.inf
@@ -1368,6 +1675,15 @@ class LGBMEstimator(BaseEstimator):
         trained = False
         if not self.HAS_CALLBACK:
             mem0 = psutil.virtual_memory().available if psutil is not None else 1
+            calibration_key = self._calibration_key(X_train)
+            calibration = (
+                LGBMEstimator._calibration_cache.get(calibration_key)
+                if BaseEstimator._in_search
+                else None
+            )
+            if not self._time_per_iter and calibration is not None:
+                self._t1, self._time_per_iter, self._mem_per_iter = calibration
+                self._train_size = X_train.shape[0]
             if (
                 (
                     not self._time_per_iter
@@ -1406,6 +1722,15 @@ class LGBMEstimator(BaseEstimator):
                     else 0.001
                 )
                 self._train_size = X_train.shape[0]
+                if BaseEstimator._in_search:
+                    calibration = (self._t1, self._time_per_iter, self._mem_per_iter)
+                    _cached_while_alive(
+                        LGBMEstimator._calibration_cache,
+                        calibration_key,
+                        lambda: calibration,
+                        (X_train,),
+                        self.CALIBRATION_CACHE_SIZE,
+                    )
                 if (
                     budget is not None
                     and self._t1 + self._t2 >= budget
@@ -1465,7 +1790,8 @@ class LGBMEstimator(BaseEstimator):
         if now + self._time_per_iter > deadline:
             raise EarlyStopException(env.iteration, env.evaluation_result_list)
         if psutil is not None:
-            mem = psutil.virtual_memory()
+            # called every boosting round; the memory reading is rate-limited
+            mem = _cached_vmem()
             if mem.available / mem.total < FREE_MEM_RATIO:
                 raise EarlyStopException(env.iteration, env.evaluation_result_list)
 
@@ -1473,6 +1799,10 @@ class LGBMEstimator(BaseEstimator):
 class XGBoostEstimator(SKLearnEstimator):
     """The class for tuning XGBoost regressor, not using sklearn API."""
 
+    DMATRIX_CACHE_SIZE = 8
+    _dmatrix_cache = OrderedDict()
+    _pred_dmatrix_cache = OrderedDict()
+
     @classmethod
     def search_space(cls, data_size, **params):
         upper = min(32768, int(data_size[0]))
@@ -1519,6 +1849,10 @@ class XGBoostEstimator(SKLearnEstimator):
                 "domain": tune.loguniform(lower=1 / 1024, upper=1024),
                 "init_value": 1.0,
             },
+            "max_bin": {
+                "domain": tune.lograndint(lower=32, upper=257),
+                "init_value": 256,
+            },
         }
 
     @classmethod
@@ -1530,15 +1864,17 @@ class XGBoostEstimator(SKLearnEstimator):
         return 1.6
 
     def config2params(self, config: dict) -> dict:
-        params = config.copy()
+        params = config if self._config_owned else config.copy()
         max_depth = params["max_depth"] = params.get("max_depth", 0)
         if max_depth == 0:
             params["grow_policy"] = params.get("grow_policy", "lossguide")
-            params["tree_method"] = params.get("tree_method", "hist")
+        # histogram building is much faster than approx/exact at equal accuracy
+        params["tree_method"] = params.get("tree_method", "hist")
         # params["booster"] = params.get("booster", "gbtree")
         params["use_label_encoder"] = params.get("use_label_encoder", False)
-        if "n_jobs" in config:
-            params["nthread"] = params.pop("n_jobs")
+        params["nthread"] = _boosting_n_jobs(
+            params.pop("n_jobs", params.get("nthread"))
+        )
         return params
 
     def __init__(
@@ -1556,12 +1892,7 @@ class XGBoostEstimator(SKLearnEstimator):
         deadline = start_time + budget if budget else np.inf
         if issparse(X_train):
             self.params["tree_method"] = "auto"
-        else:
-            X_train = self._preprocess(X_train)
-        if "sample_weight" in kwargs:
-            dtrain = xgb.DMatrix(X_train, label=y_train, weight=kwargs["sample_weight"])
-        else:
-            dtrain = xgb.DMatrix(X_train, label=y_train)
+        dtrain = self._dmatrix(X_train, y_train, kwargs.get("sample_weight"))
 
         objective = self.params.get("objective")
         if isinstance(objective, str):
@@ -1589,12 +1920,64 @@ class XGBoostEstimator(SKLearnEstimator):
         train_time = time.time() - start_time
         return train_time
 
+    def _dmatrix(self, X_train, y_train, weight=None):
+        """The training DMatrix, shared by the trials of an AutoML search on
+        the same data.
+
+        For the hist tree method, a QuantileDMatrix (xgboost>=1.7) is built
+        instead; it only keeps the binned features, so it depends on max_bin.
+        """
+        import xgboost as xgb
+
+        max_bin = None
+        matrix_class = xgb.DMatrix
+        if self.params.get("tree_method") == "hist" and hasattr(
+            xgb, "QuantileDMatrix"
+        ):
+            max_bin = self.params.get("max_bin", 256)
+            matrix_class = partial(xgb.QuantileDMatrix, max_bin=max_bin)
+
+        def build():
+            return matrix_class(
+                X_train if issparse(X_train) else self._preprocess(X_train),
+                label=y_train,
+                weight=weight,
+            )
+
+        if not BaseEstimator._in_search:
+            return build()
+        return _cached_while_alive(
+            XGBoostEstimator._dmatrix_cache,
+            (id(X_train), id(y_train), id(weight), X_train.shape, max_bin),
+            build,
+            (X_train, y_train, weight),
+            self.DMATRIX_CACHE_SIZE,
+        )
+
+    @classmethod
+    def clear_dmatrix_cache(cls):
+        """Release the cached DMatrix objects."""
+        XGBoostEstimator._dmatrix_cache.clear()
+        XGBoostEstimator._pred_dmatrix_cache.clear()
+
     def predict(self, X_test):
         import xgboost as xgb
 
-        if not issparse(X_test):
-            X_test = self._preprocess(X_test)
-        dtest = xgb.DMatrix(X_test)
+        def build():
+            return xgb.DMatrix(
+                X_test if issparse(X_test) else self._preprocess(X_test)
+            )
+
+        if not BaseEstimator._in_search:
+            return super().predict(build())
+        # every trial of a search predicts the same validation data
+        dtest = _cached_while_alive(
+            XGBoostEstimator._pred_dmatrix_cache,
+            (id(X_test), X_test.shape),
+            build,
+            (X_test,),
+            self.DMATRIX_CACHE_SIZE,
+        )
         return super().predict(dtest)
 
     @classmethod
@@ -1604,6 +1987,18 @@ class XGBoostEstimator(SKLearnEstimator):
         except ImportError:  # for xgboost<1.3
             return None
 
+        # specialize the callback to what can stop the training
+        if deadline == np.inf:
+            if psutil is None:
+                return None
+
+            class MemoryLimit(TrainingCallback):
+                def after_iteration(self, model, epoch, evals_log) -> bool:
+                    mem = _cached_vmem()
+                    return mem.available / mem.total < FREE_MEM_RATIO
+
+            return [MemoryLimit()]
+
         class ResourceLimit(TrainingCallback):
             def after_iteration(self, model, epoch, evals_log) -> bool:
                 now = time.time()
@@ -1612,7 +2007,7 @@ class XGBoostEstimator(SKLearnEstimator):
                 if now + self._time_per_iter > deadline:
                     return True
                 if psutil is not None:
-                    mem = psutil.virtual_memory()
+                    mem = _cached_vmem()
                     if mem.available / mem.total < FREE_MEM_RATIO:
                         return True
                 return False
@@ -1634,12 +2029,14 @@ class XGBoostSklearnEstimator(SKLearnEstimator, LGBMEstimator):
         return XGBoostEstimator.cost_relative2lgbm()
 
     def config2params(self, config: dict) -> dict:
-        params = config.copy()
+        params = config if self._config_owned else config.copy()
         max_depth = params["max_depth"] = params.get("max_depth", 0)
         if max_depth == 0:
             params["grow_policy"] = params.get("grow_policy", "lossguide")
-            params["tree_method"] = params.get("tree_method", "hist")
+        # histogram building is much faster than approx/exact at equal accuracy
+        params["tree_method"] = params.get("tree_method", "hist")
         params["use_label_encoder"] = params.get("use_label_encoder", False)
+        params["n_jobs"] = _boosting_n_jobs(params.get("n_jobs"))
         return params
 
     def __init__(
@@ -1690,7 +2087,11 @@ class XGBoostLimitDepthEstimator(XGBoostSklearnEstimator):
 
 
 class RandomForestEstimator(SKLearnEstimator, LGBMEstimator):
-    """The class for tuning Random Forest."""
+    """The class for tuning Random Forest.
+
+    With hist_split=True, the forest is grown by LightGBM's "rf" boosting, which
+    finds the splits on binned feature histograms instead of sorted values.
+    """
 
     HAS_CALLBACK = False
     nrows = 101
@@ -1731,13 +2132,30 @@ class RandomForestEstimator(SKLearnEstimator, LGBMEstimator):
         return 2
 
     def config2params(self, config: dict) -> dict:
-        params = config.copy()
+        params = config if self._config_owned else config.copy()
+        self._hist_split = params.pop("hist_split", False)
         if "max_leaves" in params:
             params["max_leaf_nodes"] = params.get(
                 "max_leaf_nodes", params.pop("max_leaves")
             )
-        if self._task not in CLASSIFICATION and "criterion" in config:
+        if not self._is_classification and "criterion" in config:
             params.pop("criterion")
+        if self._hist_split:
+            params = self._hist_split_params(params)
+        return params
+
+    @staticmethod
+    def _hist_split_params(params):
+        """Translate the sklearn forest params into LightGBM "rf" params."""
+        params.pop("criterion", None)
+        params["boosting_type"] = "rf"
+        params["num_leaves"] = params.pop("max_leaf_nodes", 31)
+        max_features = params.pop("max_features", 1.0)
+        if isinstance(max_features, float):
+            params["colsample_bynode"] = max_features
+        # a bootstrap sample holds about 63.2% of the distinct rows
+        params["subsample"] = params.get("subsample", 0.632)
+        params["subsample_freq"] = params.get("subsample_freq", 1)
         return params
 
     def __init__(
@@ -1746,6 +2164,14 @@ class RandomForestEstimator(SKLearnEstimator, LGBMEstimator):
         **params,
     ):
         super().__init__(task, **params)
+        if self._hist_split:
+            self.params["verbose"] = -1
+            from lightgbm import LGBMClassifier, LGBMRegressor
+
+            self.estimator_class = LGBMRegressor
+            if task in CLASSIFICATION:
+                self.estimator_class = LGBMClassifier
+            return
         self.params["verbose"] = 0
         self.estimator_class = RandomForestRegressor
         if task in CLASSIFICATION:
@@ -1761,7 +2187,10 @@ class ExtraTreesEstimator(RandomForestEstimator):
 
     def __init__(self, task="binary", **params):
         super().__init__(task, **params)
-        if "regression" in task:
+        if self._hist_split:
+            # LightGBM's extremely randomized trees draw one threshold per feature
+            self.params["extra_trees"] = True
+        elif "regression" in task:
             self.estimator_class = ExtraTreesRegressor
         else:
             self.estimator_class = ExtraTreesClassifier
@@ -1784,7 +2213,7 @@ class LRL1Classifier(SKLearnEstimator):
         return 160
 
     def config2params(self, config: dict) -> dict:
-        params = config.copy()
+        params = config if self._config_owned else config.copy()
         params["tol"] = params.get("tol", 0.0001)
         params["solver"] = params.get("solver", "saga")
         params["penalty"] = params.get("penalty", "l1")
@@ -1810,7 +2239,7 @@ class LRL2Classifier(SKLearnEstimator):
         return 25
 
     def config2params(self, config: dict) -> dict:
-        params = config.copy()
+        params = config if self._config_owned else config.copy()
         params["tol"] = params.get("tol", 0.0001)
         params["solver"] = params.get("solver", "lbfgs")
         params["penalty"] = params.get("penalty", "l2")
@@ -1826,6 +2255,8 @@ class CatBoostEstimator(BaseEstimator):
     """The class for tuning CatBoost."""
 
     ITER_HP = "n_estimators"
+    EVAL_POOL_CACHE_SIZE = 8
+    _eval_pool_cache = OrderedDict()
 
     @classmethod
     def search_space(cls, data_size, **params):
@@ -1859,30 +2290,34 @@ class CatBoostEstimator(BaseEstimator):
     def _preprocess(self, X):
         if isinstance(X, DataFrame):
             cat_columns = X.select_dtypes(include=["category"]).columns
-            if not cat_columns.empty:
-                X = X.copy()
-                X[cat_columns] = X[cat_columns].apply(
-                    lambda x: x.cat.rename_categories(
+            # catboost rejects float categories; only columns whose categories
+            # contain floats need to be renamed
+            float_columns = [
+                col
+                for col in cat_columns
+                if X[col].cat.categories.inferred_type
+                in ("floating", "mixed-integer-float", "mixed-integer", "mixed")
+            ]
+            if float_columns:
+                X = X.copy(deep=False)
+                for col in float_columns:
+                    X[col] = X[col].cat.rename_categories(
                         [
                             str(c) if isinstance(c, float) else c
-                            for c in x.cat.categories
+                            for c in X[col].cat.categories
                         ]
                     )
-                )
         elif isinstance(X, np.ndarray) and X.dtype.kind not in "buif":
             # numpy array is not of numeric dtype
-            X = DataFrame(X)
-            for col in X.columns:
-                if isinstance(X[col][0], str):
-                    X[col] = X[col].astype("category").cat.codes
-            X = X.to_numpy()
+            X = _encode_str_columns(X)
         return X
 
     def config2params(self, config: dict) -> dict:
-        params = config.copy()
+        params = config if self._config_owned else config.copy()
         params["n_estimators"] = params.get("n_estimators", 8192)
-        if "n_jobs" in params:
-            params["thread_count"] = params.pop("n_jobs")
+        params["thread_count"] = _boosting_n_jobs(
+            params.pop("n_jobs", params.get("thread_count"))
+        )
         return params
 
     def __init__(
@@ -1895,6 +2330,8 @@ class CatBoostEstimator(BaseEstimator):
             {
                 "verbose": config.get("verbose", False),
                 "random_seed": config.get("random_seed", 10242048),
+                # no snapshot/log files are needed, so a trial touches no disk
+                "allow_writing_files": config.get("allow_writing_files", False),
             }
         )
         from catboost import CatBoostRegressor
@@ -1905,11 +2342,41 @@ class CatBoostEstimator(BaseEstimator):
 
             self.estimator_class = CatBoostClassifier
 
+    def _eval_pool(self, X_train, y_train, n, X_input, cat_features):
+        """The Pool of the held-out rows X_train[n:], shared by the trials of an
+        AutoML search on the same X_input (X_train before _preprocess) and
+        y_train."""
+        from catboost import Pool
+
+        def build():
+            return Pool(data=X_train[n:], label=y_train[n:], cat_features=cat_features)
+
+        if not BaseEstimator._in_search:
+            return build()
+        return _cached_while_alive(
+            CatBoostEstimator._eval_pool_cache,
+            (
+                id(X_input),
+                id(y_train),
+                n,
+                tuple(cat_features),
+                self.params.get("border_count", 254),
+            ),
+            build,
+            (X_input, y_train),
+            self.EVAL_POOL_CACHE_SIZE,
+        )
+
+    @classmethod
+    def clear_eval_pool_cache(cls):
+        """Release the cached evaluation Pool objects."""
+        CatBoostEstimator._eval_pool_cache.clear()
+
     def fit(self, X_train, y_train, budget=None, **kwargs):
         start_time = time.time()
         deadline = start_time + budget if budget else np.inf
-        train_dir = f"catboost_{str(start_time)}"
-        X_train = self._preprocess(X_train)
+        X_input = X_train
+        X_train = self._cached_preprocess(X_train)
         if isinstance(X_train, DataFrame):
             cat_features = list(X_train.select_dtypes(include="category").columns)
         else:
@@ -1922,17 +2389,16 @@ class CatBoostEstimator(BaseEstimator):
                 kwargs["sample_weight"] = weight[:n]
         else:
             weight = None
-        from catboost import Pool, __version__
+        from catboost import __version__
 
-        model = self.estimator_class(train_dir=train_dir, **self.params)
+        model = self.estimator_class(**self.params)
+        eval_set = self._eval_pool(X_train, y_train, n, X_input, cat_features)
         if __version__ >= "0.26":
             model.fit(
                 X_tr,
                 y_tr,
                 cat_features=cat_features,
-                eval_set=Pool(
-                    data=X_train[n:], label=y_train[n:], cat_features=cat_features
-                ),
+                eval_set=eval_set,
                 callbacks=CatBoostEstimator._callbacks(start_time, deadline),
                 **kwargs,
             )
@@ -1941,12 +2407,9 @@ class CatBoostEstimator(BaseEstimator):
                 X_tr,
                 y_tr,
                 cat_features=cat_features,
-                eval_set=Pool(
-                    data=X_train[n:], label=y_train[n:], cat_features=cat_features
-                ),
+                eval_set=eval_set,
                 **kwargs,
             )
-        shutil.rmtree(train_dir, ignore_errors=True)
         if weight is not None:
             kwargs["sample_weight"] = weight
         self._model = model
@@ -1964,7 +2427,7 @@ class CatBoostEstimator(BaseEstimator):
                 if now + self._time_per_iter > deadline:
                     return False
                 if psutil is not None:
-                    mem = psutil.virtual_memory()
+                    mem = _cached_vmem()
                     if mem.available / mem.total < FREE_MEM_RATIO:
                         return False
                 return True  # can continue
@@ -1989,7 +2452,7 @@ class KNeighborsEstimator(BaseEstimator):
         return 30
 
     def config2params(self, config: dict) -> dict:
-        params = config.copy()
+        params = config if self._config_owned else config.copy()
         params["weights"] = params.get("weights", "distance")
         return params
 
@@ -2009,16 +2472,14 @@ class KNeighborsEstimator(BaseEstimator):
             cat_columns = X.select_dtypes(["category"]).columns
             if X.shape[1] == len(cat_columns):
                 raise ValueError("kneighbor requires at least one numeric feature")
-            X = X.drop(cat_columns, axis=1)
+            if not cat_columns.empty:
+                # drop() copies the frame even when there is nothing to drop
+                X = X.drop(cat_columns, axis=1)
         elif isinstance(X, np.ndarray) and X.dtype.kind not in "buif":
             # drop categocial columns if any
-            X = DataFrame(X)
-            cat_columns = []
-            for col in X.columns:
-                if isinstance(X[col][0], str):
-                    cat_columns.append(col)
-            X = X.drop(cat_columns, axis=1)
-            X = X.to_numpy()
+            str_columns = _str_columns(X)
+            if str_columns:
+                X = np.delete(X, str_columns, axis=1)
         return X
 
 
@@ -2094,12 +2555,14 @@ class Prophet(SKLearnEstimator):
             logger.warning(
                 "Estimator is not fit yet. Please run fit() before predict()."
             )
-            return np.ones(X_test.shape[0])
+            return np.broadcast_to(np.ones(1), (X_test.shape[0],))
 
 
 class ARIMA(Prophet):
     """The class for tuning ARIMA."""
 
+    _datetime_index_cache = OrderedDict()
+
     @classmethod
     def search_space(cls, **params):
         space = {
@@ -2123,10 +2586,31 @@ class ARIMA(Prophet):
 
     def _join(self, X_train, y_train):
         train_df = super()._join(X_train, y_train)
-        train_df.index = pd.to_datetime(train_df[TS_TIMESTAMP_COL])
+        train_df.index = self._datetime_index(X_train)
         train_df = train_df.drop(TS_TIMESTAMP_COL, axis=1)
         return train_df
 
+    @staticmethod
+    def _datetime_index(X_train):
+        """The timestamps of X_train as a DatetimeIndex, parsed once per X_train."""
+        timestamps = X_train[TS_TIMESTAMP_COL]
+        if timestamps.dtype.kind == "M":
+            return pd.DatetimeIndex(timestamps)
+        return _cached_while_alive(
+            ARIMA._datetime_index_cache,
+            (id(X_train), len(X_train)),
+            lambda: pd.DatetimeIndex(pd.to_datetime(timestamps)),
+            (X_train,),
+            4,
+        )
+
+    @staticmethod
+    def _endog_exog(train_df):
+        """Split the joined training frame into the series to fit and the
+        regressors (None if there are none), without copying the regressors."""
+        endog = train_df.pop(TS_VALUE_COL)
+        return endog, train_df if train_df.shape[1] else None
+
     def fit(self, X_train, y_train, budget=None, **kwargs):
         import warnings
 
@@ -2135,24 +2619,14 @@ class ARIMA(Prophet):
 
         current_time = time.time()
         train_df = self._join(X_train, y_train)
-        train_df = self._preprocess(train_df)
-        regressors = list(train_df)
-        regressors.remove(TS_VALUE_COL)
-        if regressors:
-            model = ARIMA_estimator(
-                train_df[[TS_VALUE_COL]],
-                exog=train_df[regressors],
-                order=(self.params["p"], self.params["d"], self.params["q"]),
-                enforce_stationarity=False,
-                enforce_invertibility=False,
-            )
-        else:
-            model = ARIMA_estimator(
-                train_df,
-                order=(self.params["p"], self.params["d"], self.params["q"]),
-                enforce_stationarity=False,
-                enforce_invertibility=False,
-            )
+        endog, exog = self._endog_exog(self._preprocess(train_df))
+        model = ARIMA_estimator(
+            endog,
+            exog=exog,
+            order=(self.params["p"], self.params["d"], self.params["q"]),
+            enforce_stationarity=False,
+            enforce_invertibility=False,
+        )
         with suppress_stdout_stderr():
             model = model.fit()
         train_time = time.time() - current_time
@@ -2168,11 +2642,13 @@ class ARIMA(Prophet):
                 end = X_test[TS_TIMESTAMP_COL].iloc[-1]
                 if len(X_test.columns) > 1:
                     X_test = self._preprocess(X_test.drop(columns=TS_TIMESTAMP_COL))
-                    regressors = list(X_test)
-                    print(start, end, X_test.shape)
-                    forecast = self._model.predict(
-                        start=start, end=end, exog=X_test[regressors]
-                    )
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(
+                            "forecast from {} to {}, exog shape {}".format(
+                                start, end, X_test.shape
+                            )
+                        )
+                    forecast = self._model.predict(start=start, end=end, exog=X_test)
                 else:
                     forecast = self._model.predict(start=start, end=end)
             else:
@@ -2182,7 +2658,9 @@ class ARIMA(Prophet):
                 )
             return forecast
         else:
-            return np.ones(X_test if isinstance(X_test, int) else X_test.shape[0])
+            return np.broadcast_to(
+                np.ones(1), (X_test if isinstance(X_test, int) else X_test.shape[0],)
+            )
 
 
 class SARIMAX(ARIMA):
@@ -2236,36 +2714,20 @@ class SARIMAX(ARIMA):
 
         current_time = time.time()
         train_df = self._join(X_train, y_train)
-        train_df = self._preprocess(train_df)
-        regressors = list(train_df)
-        regressors.remove(TS_VALUE_COL)
-        if regressors:
-            model = SARIMAX_estimator(
-                train_df[[TS_VALUE_COL]],
-                exog=train_df[regressors],
-                order=(self.params["p"], self.params["d"], self.params["q"]),
-                seasonality_order=(
-                    self.params["P"],
-                    self.params["D"],
-                    self.params["Q"],
-                    self.params["s"],
-                ),
-                enforce_stationarity=False,
-                enforce_invertibility=False,
-            )
-        else:
-            model = SARIMAX_estimator(
-                train_df,
-                order=(self.params["p"], self.params["d"], self.params["q"]),
-                seasonality_order=(
-                    self.params["P"],
-                    self.params["D"],
-                    self.params["Q"],
-                    self.params["s"],
-                ),
-                enforce_stationarity=False,
-                enforce_invertibility=False,
-            )
+        endog, exog = self._endog_exog(self._preprocess(train_df))
+        model = SARIMAX_estimator(
+            endog,
+            exog=exog,
+            order=(self.params["p"], self.params["d"], self.params["q"]),
+            seasonality_order=(
+                self.params["P"],
+                self.params["D"],
+                self.params["Q"],
+                self.params["s"],
+            ),
+            enforce_stationarity=False,
+            enforce_invertibility=False,
+        )
         with suppress_stdout_stderr():
             model = model.fit()
         train_time = time.time() - current_time
@@ -2274,21 +2736,51 @@ class SARIMAX(ARIMA):
 
 
 class suppress_stdout_stderr(object):
+    # /dev/null is opened once per process and shared by all the fits
+    _null_fd = None
+
     def __init__(self):
-        # Open a pair of null files
-        self.null_fds = [os.open(os.devnull, os.O_RDWR) for x in range(2)]
-        # Save the actual stdout (1) and stderr (2) file descriptors.
-        self.save_fds = (os.dup(1), os.dup(2))
+        if suppress_stdout_stderr._null_fd is None:
+            suppress_stdout_stderr._null_fd = os.open(os.devnull, os.O_RDWR)
+            atexit.register(os.close, suppress_stdout_stderr._null_fd)
 
     def __enter__(self):
+        # Save the actual stdout (1) and stderr (2) file descriptors.
+        self.save_fds = (os.dup(1), os.dup(2))
         # Assign the null pointers to stdout and stderr.
-        os.dup2(self.null_fds[0], 1)
-        os.dup2(self.null_fds[1], 2)
+        os.dup2(self._null_fd, 1)
+        os.dup2(self._null_fd, 2)
 
     def __exit__(self, *_):
         # Re-assign the real stdout/stderr back to (1) and (2)
         os.dup2(self.save_fds[0], 1)
         os.dup2(self.save_fds[1], 2)
-        # Close the null files
-        os.close(self.null_fds[0])
-        os.close(self.null_fds[1])
+        # Close the saved copies, which used to leak one pair per fit
+        os.close(self.save_fds[0])
+        os.close(self.save_fds[1])
+
+
+def clear_search_caches():
+    """Release the data memoized across the trials of a search."""
+    _PREPROCESS_CACHE.clear()
+    _GROUP_COUNTS_CACHE.clear()
+    LGBMEstimator._calibration_cache.clear()
+    XGBoostEstimator.clear_dmatrix_cache()
+    CatBoostEstimator.clear_eval_pool_cache()
+    TransformersEstimator._prep_cache.clear()
+    TransformersEstimator._dataset_cache.clear()
+    _load_teacher.cache_clear()
+    _load_pretrained.cache_clear()
+
+
+@contextmanager
+def search_caches():
+    """Share the data derived from the training data across the trials of a
+    search, and release it when the search ends."""
+    in_search = BaseEstimator._in_search
+    BaseEstimator._in_search = True
+    try:
+        yield
+    finally:
+        BaseEstimator._in_search = in_search
+        clear_search_caches()
@@ -1,14 +1,27 @@
+import copy
 import os
 
 try:
     from transformers import Seq2SeqTrainer
 except ImportError:
     Seq2SeqTrainer = object
+import torch
 import torch.nn as nn
 
+# inference_mode is only available from torch 1.9
+_inference_mode = getattr(torch, "inference_mode", torch.no_grad)
+
 class TrainerForAuto(Seq2SeqTrainer):
     def __init__(self,teacher=None,alpha_ce=0.5,alpha_task=0.5,temperature=2.0,**params):
         super().__init__(**params)
+        if teacher is not None and self.args.device.type != "cpu":
+            # the teacher is shared by the trials and stays on CPU in fp32;
+            # Module.to and .half work in place, so each trainer moves a copy.
+            # Only the teacher's logits are used, as soft targets, so half
+            # precision is enough on GPU
+            teacher = copy.deepcopy(teacher).to(self.args.device)
+            if self.args.device.type == "cuda":
+                teacher = teacher.half()
         self.teacher = teacher
         self.loss_fn = nn.KLDivLoss(reduction="batchmean")
         self.alpha_ce = alpha_ce
@@ -35,8 +48,9 @@ class TrainerForAuto(Seq2SeqTrainer):
         if self.teacher is not None:
             self.teacher.eval()
             stu_logits = outputs["logits"]
-            output_tea = self.teacher(**inputs)
-            tea_logits = output_tea["logits"]
+            with _inference_mode():
+                output_tea = self.teacher(**inputs)
+            tea_logits = output_tea["logits"].float()
             loss_ce = self.loss_fn(
                 nn.functional.log_softmax(stu_logits / self.temperature, dim=-1),
                 nn.functional.softmax(tea_logits / self.temperature, dim=-1),
@@ -75,14 +89,17 @@ class TrainerForAuto(Seq2SeqTrainer):
         prediction_loss_only,
         ignore_keys,
     ):
-        if getattr(self, "_is_seq2seq", None):
-            return super().prediction_step(
-                model, inputs, prediction_loss_only, ignore_keys
-            )
-        else:
-            return super(Seq2SeqTrainer, self).prediction_step(
-                model, inputs, prediction_loss_only, ignore_keys
-            )
+        # inference mode also skips the autograd version counters and view
+        # tracking that no_grad still pays for
+        with _inference_mode():
+            if getattr(self, "_is_seq2seq", None):
+                return super().prediction_step(
+                    model, inputs, prediction_loss_only, ignore_keys
+                )
+            else:
+                return super(Seq2SeqTrainer, self).prediction_step(
+                    model, inputs, prediction_loss_only, ignore_keys
+                )
 
 
 
@@ -127,6 +144,17 @@ class TrainerForAuto(Seq2SeqTrainer):
         else:
             self.ckpt_to_global_step = {ckpt_dir: self.state.global_step}
             self.ckpt_to_metric = {ckpt_dir: metrics} if metrics else {}
+        # the running minimum is kept as a float next to best_ckpt, so a new
+        # checkpoint is compared in O(1) without looking up ckpt_to_metric
+        if metrics:
+            loss = float(metrics["eval_loss"])
+            if loss != loss:
+                # a NaN loss ranks below any finite one
+                loss = float("inf")
+            # the first checkpoint is always taken, so best_ckpt is set
+            if not hasattr(self, "best_ckpt") or loss < self.best_loss:
+                self.best_loss = loss
+                self.best_ckpt = ckpt_dir
         return metrics
 
 # TODO: if your task is SUMMARIZATION, you need a different
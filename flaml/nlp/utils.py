@@ -1,5 +1,6 @@
 import argparse
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Dict, Any
 from ..data import SUMMARIZATION, SEQREGRESSION, SEQCLASSIFICATION, NLG_TASKS, QUESTIONANSWERING
 # >>>>>>> upstream/main
@@ -26,6 +27,15 @@ def load_default_huggingface_metric_for_task(task):
 
 global tokenized_column_names
 
+
+@lru_cache(maxsize=8)
+def load_tokenizer(model_path):
+    """The fast tokenizer of model_path, loaded once per process and shared by
+    training, tokenization and prediction."""
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(model_path, use_fast=True)
+
 # def tokenize_text(X, task, custom_hpo_task):
 #     from ..data import SEQCLASSIFICATION, SEQREGRESSION
 
@@ -39,13 +49,10 @@ global tokenized_column_names
 
 
 def tokenize_text_seqclassification(X, custom_hpo_args):
-    from transformers import AutoTokenizer
     import pandas
 
     global tokenized_column_names
-    this_tokenizer = AutoTokenizer.from_pretrained(
-        custom_hpo_args.model_path, use_fast=True
-    )
+    this_tokenizer = load_tokenizer(custom_hpo_args.model_path)
     d = X.apply(
         lambda x: tokenize_glue(x, this_tokenizer, custom_hpo_args),
         axis=1,
@@ -113,7 +120,6 @@ def tokenize_onedataframe(
     task=None,
     custom_hpo_args=None,
 ):
-    from transformers import AutoTokenizer
     import pandas
 
     global tokenized_column_names
@@ -132,9 +138,7 @@ def tokenize_onedataframe(
                 result_type="expand",
             )
     else:
-        this_tokenizer = AutoTokenizer.from_pretrained(
-            custom_hpo_args.model_path, use_fast=True
-        )
+        this_tokenizer = load_tokenizer(custom_hpo_args.model_path)
         d = X.apply(
             lambda x: tokenize_row(
                 x,
@@ -151,10 +155,17 @@ def tokenize_onedataframe(
     return X_tokenized, this_tokenizer
 
 
-def postprocess_text(preds, labels):
+@lru_cache(maxsize=1)
+def _download_punkt():
     import nltk
 
     nltk.download("punkt")
+
+
+def postprocess_text(preds, labels):
+    import nltk
+
+    _download_punkt()
     preds = [pred.strip() for pred in preds]
     labels = [label.strip() for label in labels]
 
@@ -401,6 +412,16 @@ class HPOArgs:
         fp16 (bool, optional, defaults to "False"): A bool, whether to use FP16.
         max_seq_length (int, optional, defaults to 128): An integer, the max length of the sequence.
         ckpt_per_epoch (int, optional, defaults to 1): An integer, the number of checkpoints per epoch.
+        use_compile (bool, optional, defaults to False): A bool, whether to torch.compile the model
+            (requires PyTorch 2.0 and a transformers version supporting torch_compile).
+        dataloader_num_workers (int, optional, defaults to None): An integer, the number of
+            DataLoader worker processes; None for min(8, cpu_count // 2).
+        gradient_checkpointing (bool, optional, defaults to None): A bool, whether to use
+            gradient checkpointing; None for using it on models with more than 100M parameters.
+        target_effective_batch_size (int, optional, defaults to None): An integer, the batch
+            size to accumulate gradients up to; None for no gradient accumulation.
+        predict_batch_size (int, optional, defaults to 64): An integer, the batch size for
+            prediction; halved automatically on CUDA out of memory errors.
 
     """
 
@@ -419,6 +440,27 @@ class HPOArgs:
 
     ckpt_per_epoch: int = field(default=1, metadata={"help": "checkpoint per epoch"})
 
+    use_compile: bool = field(
+        default=False, metadata={"help": "whether to torch.compile the model"}
+    )
+
+    dataloader_num_workers: int = field(
+        default=None, metadata={"help": "number of DataLoader worker processes"}
+    )
+
+    gradient_checkpointing: bool = field(
+        default=None, metadata={"help": "whether to use gradient checkpointing"}
+    )
+
+    target_effective_batch_size: int = field(
+        default=None,
+        metadata={"help": "batch size to accumulate gradients up to"},
+    )
+
+    predict_batch_size: int = field(
+        default=64, metadata={"help": "batch size for prediction"}
+    )
+
     @staticmethod
     def load_args():
         from dataclasses import fields
@@ -441,6 +483,10 @@ class HPOArgs:
         console_args, unknown = arg_parser.parse_known_args()
         return console_args
 
+
+DISTIL_MODEL_TYPES = ("bert", "xlnet", "xlm", "distilbert", "roberta")
+
+
 @dataclass
 class DISTILHPOArgs:
     """The HPO setting
@@ -457,38 +503,22 @@ class DISTILHPOArgs:
             An integer, the max length of the sequence
         ckpt_per_epoch (:obj:`int`, `optional`, defaults to :obj:`1`):
             An integer, the number of checkpoints per epoch
+        use_compile (:obj:`bool`, `optional`, defaults to :obj:`False`):
+            A bool, whether to torch.compile the student model
+        dataloader_num_workers (:obj:`int`, `optional`, defaults to :obj:`None`):
+            An integer, the number of DataLoader worker processes, None for min(8, cpu_count // 2)
+        gradient_checkpointing (:obj:`bool`, `optional`, defaults to :obj:`None`):
+            A bool, whether to use gradient checkpointing, None for models with more than 100M parameters
+        target_effective_batch_size (:obj:`int`, `optional`, defaults to :obj:`None`):
+            An integer, the batch size to accumulate gradients up to, None for no accumulation
+        predict_batch_size (:obj:`int`, `optional`, defaults to :obj:`64`):
+            An integer, the batch size for prediction, halved on CUDA out of memory errors
 
     """
-    from transformers import (
-        BertConfig,
-        BertForQuestionAnswering,
-        BertTokenizer,
-        DistilBertConfig,
-        DistilBertForQuestionAnswering,
-        DistilBertTokenizer,
-        RobertaConfig,
-        RobertaForQuestionAnswering,
-        RobertaTokenizer,
-        XLMConfig,
-        XLMForQuestionAnswering,
-        XLMTokenizer,
-        XLNetConfig,
-        XLNetForQuestionAnswering,
-        XLNetTokenizer,
-    )
-
-    MODEL_CLASSES = {
-        "bert": (BertConfig, BertForQuestionAnswering, BertTokenizer),
-        "xlnet": (XLNetConfig, XLNetForQuestionAnswering, XLNetTokenizer),
-        "xlm": (XLMConfig, XLMForQuestionAnswering, XLMTokenizer),
-        "distilbert": (DistilBertConfig, DistilBertForQuestionAnswering, DistilBertTokenizer),
-        "roberta": (RobertaConfig, RobertaForQuestionAnswering, RobertaTokenizer),
-    }
-
     student_type: str = field(
         default=None,
         metadata={"required":True,
-                  "help": "Model type selected in the list: " + ", ".join(MODEL_CLASSES.keys())})
+                  "help": "Model type selected in the list: " + ", ".join(DISTIL_MODEL_TYPES)})
 
     student_name_or_path: str = field(
         default=None, metadata={"required":True,
@@ -535,6 +565,27 @@ class DISTILHPOArgs:
 
     ckpt_per_epoch: int = field(default=1, metadata={"help": "checkpoint per epoch"})
 
+    use_compile: bool = field(
+        default=False, metadata={"help": "whether to torch.compile the model"}
+    )
+
+    dataloader_num_workers: int = field(
+        default=None, metadata={"help": "number of DataLoader worker processes"}
+    )
+
+    gradient_checkpointing: bool = field(
+        default=None, metadata={"help": "whether to use gradient checkpointing"}
+    )
+
+    target_effective_batch_size: int = field(
+        default=None,
+        metadata={"help": "batch size to accumulate gradients up to"},
+    )
+
+    predict_batch_size: int = field(
+        default=64, metadata={"help": "batch size for prediction"}
+    )
+
     @staticmethod
     def load_args():
         from dataclasses import fields
@@ -0,0 +1,231 @@
+import signal
+import time
+
+import numpy as np
+import pytest
+from sklearn.datasets import load_breast_cancer, load_diabetes
+from sklearn.ensemble import RandomForestClassifier, ExtraTreesRegressor
+
+from flaml.model import (
+    BaseEstimator,
+    XGBoostEstimator,
+    RandomForestEstimator,
+    ExtraTreesEstimator,
+    limit_resource,
+    _cached_group_counts,
+    search_caches,
+)
+
+
+def test_xgboost_dmatrix_cache():
+    import xgboost as xgb
+
+    X, y = load_breast_cancer(return_X_y=True)
+    estimator = XGBoostEstimator(task="binary", n_estimators=4, max_leaves=4)
+    # a direct fit never reuses a DMatrix, so in-place edits are seen
+    assert estimator._dmatrix(X, y) is not estimator._dmatrix(X, y)
+    X_edit = X.copy()
+    estimator.fit(X_edit, y)
+    pred = estimator.predict(X)
+    assert not (pred == pred[0]).all()
+    X_edit[:] = 0
+    estimator.fit(X_edit, y)
+    pred = estimator.predict(X)
+    assert (pred == pred[0]).all()
+    assert not XGBoostEstimator._dmatrix_cache
+    assert not XGBoostEstimator._pred_dmatrix_cache
+
+    BaseEstimator._in_search = True
+    try:
+        dtrain = estimator._dmatrix(X, y)
+        assert estimator._dmatrix(X, y) is dtrain
+        assert estimator._dmatrix(X.copy(), y) is not dtrain
+        # the trials predict the same validation data
+        pred = estimator.predict(X)
+        assert len(XGBoostEstimator._pred_dmatrix_cache) == 1
+        assert np.array_equal(estimator.predict(X), pred)
+        assert len(XGBoostEstimator._pred_dmatrix_cache) == 1
+        # a QuantileDMatrix only keeps the bins, so it is keyed by max_bin
+        hist = [
+            XGBoostEstimator(
+                task="binary",
+                n_estimators=4,
+                max_leaves=4,
+                tree_method="hist",
+                max_bin=max_bin,
+            )
+            for max_bin in (16, 64)
+        ]
+        dhist = [est._dmatrix(X, y) for est in hist]
+        if hasattr(xgb, "QuantileDMatrix"):
+            assert all(isinstance(d, xgb.QuantileDMatrix) for d in dhist)
+            assert dhist[0] is not dhist[1] and dhist[0] is not dtrain
+        else:
+            assert dhist[0] is dhist[1] is dtrain
+        for est in hist:
+            est.fit(X, y)
+            assert est.predict(X).shape == y.shape
+    finally:
+        BaseEstimator._in_search = False
+        XGBoostEstimator.clear_dmatrix_cache()
+    assert not XGBoostEstimator._dmatrix_cache
+    assert not XGBoostEstimator._pred_dmatrix_cache
+    assert np.array_equal(estimator.predict(X), estimator.predict(X))
+    assert not XGBoostEstimator._pred_dmatrix_cache
+
+
+def test_forest_hist_split():
+    from lightgbm import LGBMClassifier, LGBMRegressor
+
+    X, y = load_breast_cancer(return_X_y=True)
+    for estimator_class in (RandomForestEstimator, ExtraTreesEstimator):
+        estimator = estimator_class(
+            task="binary",
+            n_estimators=8,
+            max_leaves=16,
+            max_features=0.5,
+            criterion="entropy",
+            hist_split=True,
+        )
+        params = estimator.params
+        assert estimator.estimator_class is LGBMClassifier
+        assert params["boosting_type"] == "rf"
+        assert params["num_leaves"] == 16
+        assert params["colsample_bynode"] == 0.5
+        assert params["subsample"] == 0.632 and params["subsample_freq"] == 1
+        assert params.get("extra_trees", False) == (
+            estimator_class is ExtraTreesEstimator
+        )
+        for name in ("criterion", "max_leaf_nodes", "max_features", "hist_split"):
+            assert name not in params
+        estimator.fit(X, y)
+        assert (estimator.predict(X) == y).mean() > 0.9
+        proba = estimator.predict_proba(X)
+        assert proba.shape == (len(y), 2)
+        assert np.allclose(proba.sum(axis=1), 1)
+
+    # without hist_split, the sklearn forests are used as before
+    assert (
+        RandomForestEstimator(task="binary", n_estimators=4).estimator_class
+        is RandomForestClassifier
+    )
+    assert (
+        ExtraTreesEstimator(task="regression", n_estimators=4).estimator_class
+        is ExtraTreesRegressor
+    )
+
+    X, y = load_diabetes(return_X_y=True)
+    for estimator_class in (RandomForestEstimator, ExtraTreesEstimator):
+        estimator = estimator_class(
+            task="regression", n_estimators=8, max_leaves=16, hist_split=True
+        )
+        assert estimator.estimator_class is LGBMRegressor
+        assert "criterion" not in estimator.params
+        estimator.fit(X, y)
+        pred = estimator.predict(X)
+        assert pred.shape == y.shape
+        assert np.corrcoef(pred, y)[0, 1] > 0.5
+
+
+@pytest.mark.skipif(not hasattr(signal, "setitimer"), reason="no interval timers")
+def test_limit_resource():
+    start_time = time.time()
+    with pytest.raises(TimeoutError):
+        with limit_resource(-1, 0.3):
+            time.sleep(2)
+    assert time.time() - start_time < 1
+
+    fired = []
+
+    def outer_handler(sig, frame):
+        fired.append(sig)
+
+    handler = signal.signal(signal.SIGALRM, outer_handler)
+    try:
+        # an alarm set by the caller outlives the limit
+        signal.setitimer(signal.ITIMER_REAL, 1)
+        with limit_resource(-1, 0.3):
+            pass
+        assert signal.getsignal(signal.SIGALRM) is outer_handler
+        delay, _ = signal.getitimer(signal.ITIMER_REAL)
+        assert 0 < delay <= 1
+        time.sleep(1.5)
+        assert fired == [signal.SIGALRM]
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, handler)
+
+
+def test_cached_group_counts():
+    groups = np.array([7, 7, 3, 3, 3, 5])
+    counts = _cached_group_counts(groups)
+    assert counts.tolist() == [2, 3, 1]
+    assert _cached_group_counts(groups) is counts
+    # the same ids in a re-created array hit the cache
+    assert _cached_group_counts(groups.copy()) is counts
+    # edited in place
+    groups[:] = [1, 1, 1, 1, 2, 2]
+    assert _cached_group_counts(groups).tolist() == [4, 2]
+    # re-created with other ids, possibly at the same address
+    del groups
+    groups = np.array([4, 4, 4, 6, 6, 8])
+    assert _cached_group_counts(groups).tolist() == [3, 2, 1]
+    # lists and string ids are counted as well
+    assert _cached_group_counts([1, 1, 2]).tolist() == [2, 1]
+    names = np.array(["b", "b", "a"], dtype=object)
+    assert _cached_group_counts(names).tolist() == [2, 1]
+
+
+def test_preprocess_cache():
+    import pandas as pd
+    from flaml.model import _PREPROCESS_CACHE
+
+    X = pd.DataFrame(
+        {
+            "a": [0.0, 1.0, 2.0, 3.0, 4.0, 5.0],
+            "c": pd.Categorical(["x", "y", "x", "y", "x", "y"]),
+        }
+    )
+    y = np.array([0, 1, 0, 1, 0, 1])
+    config = {"n_estimators": 4, "max_features": 1.0}
+    RandomForestEstimator(task="binary", **config).fit(X, y)
+    # swap the categories of the same frame in place
+    X["c"] = pd.Categorical(["y", "x", "y", "x", "y", "x"])
+    y = 1 - y
+    estimator = RandomForestEstimator(task="binary", **config)
+    estimator.fit(X, y)
+    assert estimator.predict(X).tolist() == y.tolist()
+    assert not _PREPROCESS_CACHE
+
+    # during a search, the trials share the preprocessed training data
+    with search_caches():
+        estimator.fit(X, y)
+        assert len(_PREPROCESS_CACHE) == 1
+        X_pre = next(iter(_PREPROCESS_CACHE.values()))
+        estimator.fit(X, y)
+        assert next(iter(_PREPROCESS_CACHE.values())) is X_pre
+    assert not _PREPROCESS_CACHE and not BaseEstimator._in_search
+
+
+def test_calibration_cache():
+    from flaml.model import LGBMEstimator
+
+    X, y = load_breast_cancer(return_X_y=True)
+    config = {"n_estimators": 8, "max_leaves": 8}
+    RandomForestEstimator(task="binary", **config).fit(X, y, budget=10)
+    assert not LGBMEstimator._calibration_cache
+
+    with search_caches():
+        RandomForestEstimator(task="binary", **config).fit(X, y, budget=10)
+        assert len(LGBMEstimator._calibration_cache) == 1
+        (calibration,) = LGBMEstimator._calibration_cache.values()
+        estimator = RandomForestEstimator(task="binary", **config)
+        estimator.fit(X, y, budget=10)
+        assert estimator._time_per_iter == calibration[1]
+        # other data of the same shape is calibrated on its own
+        X_other = X[::-1].copy()
+        RandomForestEstimator(task="binary", **config).fit(X_other, y, budget=10)
+        assert len(LGBMEstimator._calibration_cache) == 2
+        del X_other
+        assert len(LGBMEstimator._calibration_cache) == 1
+    assert not LGBMEstimator._calibration_cache
@@ -0,0 +1,108 @@
+import os
+from concurrent.futures import wait
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+
+
+def _trainer_with_losses(monkeypatch, output_dir, losses):
+    """A TrainerForAuto whose evaluate() saw the given eval losses, one per step."""
+    pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+    from flaml.nlp.huggingface.trainer import TrainerForAuto
+
+    metrics = iter([{"eval_loss": loss} for loss in losses])
+    monkeypatch.setattr(
+        transformers.Trainer, "evaluate", lambda self, *args: next(metrics)
+    )
+    trainer = TrainerForAuto.__new__(TrainerForAuto)
+    trainer.args = SimpleNamespace(output_dir=str(output_dir))
+    trainer.eval_dataset = [0]
+    for step in range(1, len(losses) + 1):
+        trainer.state = SimpleNamespace(global_step=step)
+        trainer.evaluate()
+    return trainer
+
+
+def _estimator(output_dir):
+    from flaml.model import TransformersEstimator
+    from flaml.nlp.utils import HPOArgs
+
+    estimator = TransformersEstimator(task="seq-classification")
+    estimator.custom_hpo_args = HPOArgs(output_dir=str(output_dir), fp16=False)
+    estimator.use_ray = False
+    return estimator
+
+
+@pytest.mark.parametrize(
+    "losses, best_step",
+    [
+        ([0.9, 0.5, 0.7], 2),
+        ([float("nan"), 0.6, float("nan"), 0.4, 0.5], 4),
+        ([0.8, float("nan")], 1),
+        # with no finite loss, the first checkpoint is kept
+        ([float("nan"), float("nan")], 1),
+    ],
+)
+def test_select_checkpoint(monkeypatch, tmp_path, losses, best_step):
+    trainer = _trainer_with_losses(monkeypatch, tmp_path, losses)
+    for ckpt in trainer.ckpt_to_metric:
+        os.makedirs(ckpt)
+    estimator = _estimator(tmp_path)
+    best_ckpt = estimator._select_checkpoint(trainer)
+    assert best_ckpt.endswith(f"checkpoint-{best_step}")
+    assert estimator.params[estimator.ITER_HP] == best_step
+    assert list(trainer.ckpt_to_metric) == [best_ckpt]
+    assert trainer.ckpt_to_global_step == {best_ckpt: best_step}
+    # the other checkpoints are deleted in the background
+    wait(estimator._cleanup_futures)
+    assert sorted(os.listdir(tmp_path)) == [".trash", f"checkpoint-{best_step}"]
+
+
+def test_predict_trainer_cache(monkeypatch, tmp_path):
+    torch = pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from flaml.model import TransformersEstimator
+    from flaml.nlp import utils
+
+    loaded = []
+
+    def load_model(checkpoint_path, **kwargs):
+        loaded.append(checkpoint_path)
+        return torch.nn.Linear(2, 2)
+
+    monkeypatch.setattr(utils, "load_model", load_model)
+    monkeypatch.setattr(TransformersEstimator, "_predict_trainer_cache", OrderedDict())
+    cache = TransformersEstimator._predict_trainer_cache
+
+    def estimator(checkpoint_path):
+        est = _estimator(tmp_path)
+        est._checkpoint_path = checkpoint_path
+        est._num_labels = 2
+        est._per_model_config = None
+        est._training_args_config = {}
+        est._tokenizer = None
+        return est
+
+    first = estimator("ckpt-a")._get_predict_trainer()
+    # a copy of the estimator reuses the trainer with the loaded model
+    assert estimator("ckpt-a")._get_predict_trainer() is first
+    assert loaded == ["ckpt-a"]
+    assert first.args.per_device_eval_batch_size == 64
+
+    estimator("ckpt-b")._get_predict_trainer()
+    assert estimator("ckpt-a")._get_predict_trainer() is first
+    # beyond PREDICT_CACHE_SIZE, the least recently used trainer is evicted
+    estimator("ckpt-c")._get_predict_trainer()
+    assert len(cache) == TransformersEstimator.PREDICT_CACHE_SIZE == 2
+    assert [key[0] for key in cache] == ["ckpt-a", "ckpt-c"]
+    assert loaded == ["ckpt-a", "ckpt-b", "ckpt-c"]
+    estimator("ckpt-b")._get_predict_trainer()
+    assert loaded[-1] == "ckpt-b"
+    assert [key[0] for key in cache] == ["ckpt-c", "ckpt-b"]
+
+    # cleanup() drops the estimator's own trainer
+    est = estimator("ckpt-c")
+    est.cleanup()
+    assert [key[0] for key in cache] == ["ckpt-b"]
@@ -0,0 +1,79 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pytest
+
+
+@dataclass
+class _Args:
+    per_device_eval_batch_size: int
+    dataloader_num_workers: int = 0
+
+
+class _OOMTrainer:
+    """Predicts batch by batch, running out of CUDA memory above max_batch_size."""
+
+    def __init__(self, args, max_batch_size):
+        self.args = args
+        self.max_batch_size = max_batch_size
+        self.batch_sizes = []
+
+    def predict(self, test_dataset, **kwargs):
+        batch_size = self.args.per_device_eval_batch_size
+        self.batch_sizes.append(batch_size)
+        if batch_size > self.max_batch_size:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        self.kwargs = kwargs
+        return np.concatenate(
+            [
+                test_dataset[i : i + batch_size] * 2
+                for i in range(0, len(test_dataset), batch_size)
+            ]
+        )
+
+
+def _estimator(max_batch_size):
+    from flaml.model import TransformersEstimator
+    from flaml.nlp.utils import HPOArgs
+
+    estimator = TransformersEstimator.__new__(TransformersEstimator)
+    # the predict trainer starts from predict_batch_size, see _get_predict_trainer
+    args = _Args(per_device_eval_batch_size=HPOArgs().predict_batch_size)
+    estimator._model = _OOMTrainer(args, max_batch_size)
+    return estimator
+
+
+def test_predict_batched():
+    # the OOM branch empties the CUDA cache, which needs torch
+    pytest.importorskip("torch")
+    test_dataset = np.arange(100)
+
+    estimator = _estimator(max_batch_size=16)
+    trainer = estimator._model
+    predictions = estimator._predict_batched(test_dataset, max_length=5)
+    assert (predictions == test_dataset * 2).all()
+    assert trainer.batch_sizes == [64, 32, 16]
+    assert trainer.kwargs == {"max_length": 5}
+    # the reduced batch size is kept for the next prediction
+    estimator._predict_batched(test_dataset)
+    assert trainer.batch_sizes[-1] == 16
+    assert trainer.args.per_device_eval_batch_size == 16
+
+    # down to a single row per batch
+    estimator = _estimator(max_batch_size=1)
+    predictions = estimator._predict_batched(test_dataset)
+    assert (predictions == test_dataset * 2).all()
+    assert estimator._model.batch_sizes == [64, 32, 16, 8, 4, 2, 1]
+
+    # out of memory even with a batch size of 1 is raised
+    estimator = _estimator(max_batch_size=0)
+    with pytest.raises(RuntimeError, match="out of memory"):
+        estimator._predict_batched(test_dataset)
+    assert estimator._model.batch_sizes[-1] == 1
+    assert estimator._model.args.per_device_eval_batch_size == 1
+
+    # other errors are not retried
+    estimator = _estimator(max_batch_size=64)
+    estimator._model.predict = lambda test_dataset: 1 / 0
+    with pytest.raises(ZeroDivisionError):
+        estimator._predict_batched(test_dataset)